@@ -41,11 +41,27 @@ class Config:
     CLUSTERING_MIN_K = 2
     CLUSTERING_MAX_K = 12
     CLUSTERING_K = 5  # used only if CLUSTERING_AUTO_K is False
+    # With auto k, the full k sweep runs at most this often; runs in between keep the
+    # last k and warm-start from the stored cluster centroids
+    CLUSTERING_SWEEP_INTERVAL_HOURS = int(os.environ.get('CLUSTERING_SWEEP_INTERVAL_HOURS', '24'))
     
     # Background clustering settings
     BACKGROUND_CLUSTERING_ENABLED = os.environ.get('BACKGROUND_CLUSTERING_ENABLED', 'true').lower() == 'true'
     CLUSTERING_MESSAGE_THRESHOLD = int(os.environ.get('CLUSTERING_MESSAGE_THRESHOLD', '1'))
     CLUSTERING_TIME_THRESHOLD_MINUTES = int(os.environ.get('CLUSTERING_TIME_THRESHOLD_MINUTES', '5'))
+    ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', '4'))
+    # Conversations analyzed in parallel at the start of a full clustering run
+    ANALYSIS_CONCURRENCY = int(os.environ.get('ANALYSIS_CONCURRENCY', '8'))
+    # Concurrent concept-extraction requests to Claude, shared by all conversations
+    EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', '8'))
+    
+    # Concept summary/questions generation (I/O-bound Claude calls, shared by all courses)
+    CONCEPT_CONTENT_WORKERS = int(os.environ.get('CONCEPT_CONTENT_WORKERS', '32'))
+    
+    # Study/teachback chat history window: grows from CHAT_WINDOW_MIN+1 up to CHAT_WINDOW_MAX
+    # messages, then jumps forward by CHAT_WINDOW_MIN (keeps the prompt prefix stable between jumps)
+    CHAT_WINDOW_MIN = 10
+    CHAT_WINDOW_MAX = 20
 
 class DevelopmentConfig(Config):
     DEBUG = True
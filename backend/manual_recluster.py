@@ -263,7 +263,7 @@ def method_direct(services, reset=False):
     
     print("Running direct clustering...")
     try:
-        success = clustering_service.cluster_all_conversations()
+        success = clustering_service.cluster_all_conversations(force=True)
         
         if success:
             print("✓ Direct clustering completed successfully")
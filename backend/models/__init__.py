@@ -1,5 +1,6 @@
 from .conversation import Conversation
 from .message import Message
 from .cluster import ConversationCluster, ClusteringRun
+from .concept_cache import ConceptCache
 
-__all__ = ['Conversation', 'Message', 'ConversationCluster', 'ClusteringRun']
+__all__ = ['Conversation', 'Message', 'ConversationCluster', 'ClusteringRun', 'ConceptCache']
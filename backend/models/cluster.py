@@ -1,4 +1,4 @@
-from mongoengine import Document, StringField, ListField, FloatField, IntField, DateTimeField
+from mongoengine import Document, StringField, ListField, FloatField, IntField, DateTimeField, BooleanField
 from datetime import datetime
 from bson import ObjectId
 
@@ -24,6 +24,7 @@ class ConversationCluster(Document):
         'indexes': [
             'cluster_id',
             'updated_at',
+            'created_at',  # Newest-first study guide listing
         ]
     }
     
@@ -111,6 +112,8 @@ class ClusteringRun(Document):
     run_id = StringField(required=True, unique=True, max_length=50)
     total_conversations = IntField(required=True)
     clusters_created = IntField(required=True)
+    k_swept = BooleanField(default=False)  # True if k came from a full k sweep in this run
+    started_at = DateTimeField()  # When the run began reading conversations
     created_at = DateTimeField(default=datetime.utcnow)
     
     # Index for efficient queries
@@ -123,12 +126,15 @@ class ClusteringRun(Document):
     }
     
     @classmethod
-    def create_run(cls, total_conversations: int, clusters_created: int) -> 'ClusteringRun':
+    def create_run(cls, total_conversations: int, clusters_created: int, k_swept: bool = False,
+                   started_at: datetime = None) -> 'ClusteringRun':
         """Create a new clustering run record"""
         run = cls(
             run_id=f"run_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}",
             total_conversations=total_conversations,
-            clusters_created=clusters_created
+            clusters_created=clusters_created,
+            k_swept=k_swept,
+            started_at=started_at
         )
         run.save()
         return run
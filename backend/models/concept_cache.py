@@ -0,0 +1,25 @@
+from mongoengine import Document, StringField, ListField, DictField, DateTimeField
+from datetime import datetime
+from typing import List, Optional
+
+class ConceptCache(Document):
+    """Concept cache model - stores extracted concepts keyed by the sha256 of the message content"""
+
+    # Fields
+    content_hash = StringField(primary_key=True, max_length=64)  # sha256 hex digest of the content
+    concepts = ListField(DictField())  # [{'title': ..., 'summary': ...}] as returned by extraction
+    created_at = DateTimeField(default=datetime.utcnow)
+
+    # Collection name in MongoDB (lookups go through the _id primary key, no extra indexes)
+    meta = {'collection': 'concept_cache'}
+
+    @classmethod
+    def get_concepts(cls, content_hash: str) -> Optional[List[dict]]:
+        """Get the cached concepts for a content hash, or None if not cached"""
+        entry = cls.objects(pk=content_hash).only('concepts').first()
+        return entry.concepts if entry else None
+
+    @classmethod
+    def store_concepts(cls, content_hash: str, concepts: List[dict]):
+        """Cache the concepts extracted for a content hash (overwrites any previous entry)"""
+        cls(content_hash=content_hash, concepts=concepts).save()
@@ -13,6 +13,15 @@ class Conversation(Document):
     created_at = DateTimeField(default=datetime.utcnow)
     updated_at = DateTimeField(default=datetime.utcnow)
     
+    # Index for efficient queries
+    meta = {
+        'collection': 'conversations',
+        'indexes': [
+            'updated_at',  # Latest-update lookup before each clustering run
+            {'fields': ['-updated_at', '-id']},  # Keyset pagination of the conversation list
+        ]
+    }
+    
     def save(self, *args, **kwargs):
         """Override save to update the updated_at field"""
         self.updated_at = datetime.utcnow()
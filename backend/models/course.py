@@ -1,5 +1,6 @@
 from mongoengine import Document, StringField, ListField, EmbeddedDocument, EmbeddedDocumentField, DateTimeField, BooleanField
 from datetime import datetime
+from bson import ObjectId
 
 class CourseConcept(EmbeddedDocument):
     """Embedded document for course concepts with learning status"""
@@ -138,6 +139,39 @@ class Course(Document):
         self.updated_at = datetime.utcnow()
         return super(Course, self).save(*args, **kwargs)
     
+    @classmethod
+    def _update_concept_if_idle(cls, course_id: str, concept_title: str, streaming_flag: str, fields: dict) -> bool:
+        """
+        Atomically $set fields on one embedded concept unless its streaming_flag is set
+        
+        The concept is matched and checked in the same update ($elemMatch + positional $),
+        so there is no read-check-save window and the course document is never loaded.
+        Returns True if the concept was updated.
+        """
+        updates = {f'concepts.$.{name}': value for name, value in fields.items()}
+        updates['updated_at'] = datetime.utcnow()
+        updated = cls.objects(__raw__={
+            '_id': ObjectId(course_id),
+            'concepts': {'$elemMatch': {'title': concept_title, streaming_flag: {'$ne': True}}}
+        }).update_one(__raw__={'$set': updates})
+        return updated > 0
+    
+    @classmethod
+    def set_concept_summary_if_idle(cls, course_id: str, concept_title: str, summary_text: str) -> bool:
+        """Set a concept's summary unless a summary is being streamed for it right now"""
+        return cls._update_concept_if_idle(course_id, concept_title, 'is_streaming_summary', {
+            'summary': summary_text,
+            'summary_generated_at': datetime.utcnow()
+        })
+    
+    @classmethod
+    def set_concept_questions_if_idle(cls, course_id: str, concept_title: str, questions: list) -> bool:
+        """Set a concept's teaching questions unless questions are being streamed for it right now"""
+        return cls._update_concept_if_idle(course_id, concept_title, 'is_streaming_questions', {
+            'teaching_questions': questions,
+            'teaching_questions_generated_at': datetime.utcnow()
+        })
+    
     def _calculate_progress(self):
         """Calculate learning progress percentage"""
         if not self.concepts:
@@ -153,6 +187,13 @@ class Course(Document):
                 return concept
         return None
     
+    def get_concept_map(self) -> dict:
+        """Map concept titles to concepts in one pass (first occurrence wins, as in get_concept_by_title)"""
+        concept_map = {}
+        for concept in self.concepts:
+            concept_map.setdefault(concept.title, concept)
+        return concept_map
+    
     def update_concept_status(self, concept_title: str, new_status: str):
         """Update the status of a specific concept"""
         concept = self.get_concept_by_title(concept_title)
@@ -166,8 +207,9 @@ class Course(Document):
         """Start review process by updating concept statuses and course stage"""
         # Update selected concepts to 'reviewing' status
         # Leave unselected concepts as 'not_started'
+        selected = set(selected_concept_titles)
         for concept in self.concepts:
-            if concept.title in selected_concept_titles:
+            if concept.title in selected:
                 concept.status = 'reviewing'
             # Unselected concepts remain 'not_started' - no change needed
         
@@ -1,4 +1,4 @@
-from mongoengine import Document, StringField, DateTimeField, ListField, FloatField, BooleanField
+from mongoengine import Document, StringField, DateTimeField, ListField, BinaryField, BooleanField
 from datetime import datetime
 from bson import ObjectId
 
@@ -17,7 +17,7 @@ class Message(Document):
     
     # Semantic clustering fields
     technical_concepts = ListField(StringField())  # Extracted technical concepts
-    embedding = ListField(FloatField())  # 1024-dim vector from Anthropic
+    embedding = BinaryField()  # 1024-dim float32 vector, packed (see message_analysis_service.pack_embedding)
     processed_for_clustering = BooleanField(default=False)  # Analysis status
     
     # Index for efficient queries
@@ -27,6 +27,8 @@ class Message(Document):
             'conversation_id',
             'message_id',
             ('conversation_id', 'created_at'),  # Compound index for conversation message ordering
+            ('conversation_id', 'processed_for_clustering'),  # Per-conversation analysis and feature lookups
+            'processed_for_clustering',  # Unprocessed-message counts on every background analysis trigger
         ]
     }
     
@@ -127,7 +127,7 @@ def analyze_conversation(conversation_id):
 def run_clustering():
     """Trigger a full clustering run on all conversations"""
     try:
-        success = clustering_service.cluster_all_conversations()
+        success = clustering_service.cluster_all_conversations(force=True)
         
         if success:
             clusters = clustering_service.get_all_clusters()
@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify, Response
 import json
 from models.course import Course
-from services.anthropic_service import AnthropicService
+from services.anthropic_service import AnthropicService, StreamChunk, STREAM_COMPLETE
 
 concept_bp = Blueprint('concept', __name__)
 
@@ -30,23 +30,24 @@ def stream_concept_summary(course_id, concept_title):
         
         def generate():
             try:
-                full_content = ""
+                # Only deltas go to the client; pieces are joined once for saving
+                content_parts = []
                 for chunk in anthropic_service.stream_concept_summary(
                     concept_title, 
                     course.description
                 ):
-                    if chunk.get('content'):
-                        full_content += chunk['content']
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    if chunk.content:
+                        content_parts.append(chunk.content)
+                    yield chunk.to_sse()
                     
-                    if chunk.get('is_complete'):
+                    if chunk.is_complete:
                         # Reload course to get fresh state
                         fresh_course = Course.objects(id=course_id).first()
                         fresh_concept = fresh_course.get_concept_by_title(concept_title)
                         
                         if fresh_concept:
                             # Save the complete summary
-                            fresh_concept.set_summary(full_content)
+                            fresh_concept.set_summary("".join(content_parts))
                             fresh_concept.is_streaming_summary = False
                             fresh_course.save()
                         break
@@ -112,7 +113,7 @@ def stream_concept_questions(course_id, concept_title):
                 )
                 
                 # Send questions as streaming response
-                yield f"data: {json.dumps({'content': json.dumps(questions), 'is_complete': False, 'error': None})}\n\n"
+                yield StreamChunk(json.dumps(questions)).to_sse()
                 
                 # Reload course to get fresh state
                 fresh_course = Course.objects(id=course_id).first()
@@ -125,7 +126,7 @@ def stream_concept_questions(course_id, concept_title):
                     fresh_course.save()
                 
                 # Send completion signal
-                yield f"data: {json.dumps({'content': '', 'is_complete': True, 'error': None})}\n\n"
+                yield STREAM_COMPLETE.to_sse()
                         
             except Exception as e:
                 # Clear streaming flag on error
@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify, Response
 from marshmallow import ValidationError
-import json
+import orjson
 from datetime import datetime
 
 from dto.conversation_dto import (
@@ -21,16 +21,15 @@ def create_sse_response(generator):
     def event_stream():
         try:
             for data in generator:
-                # Format as SSE
-                json_data = json.dumps(data)
-                yield f"data: {json_data}\n\n"
+                # Format as SSE (orjson emits UTF-8 bytes directly, no str round-trip)
+                yield b"data: " + orjson.dumps(data) + b"\n\n"
         except Exception as e:
             # Send error event
-            error_data = json.dumps({
+            error_data = orjson.dumps({
                 'error': str(e),
                 'is_complete': True
             })
-            yield f"data: {error_data}\n\n"
+            yield b"data: " + error_data + b"\n\n"
     
     return Response(
         event_stream(),
@@ -86,20 +85,23 @@ def list_conversations():
     
     Query parameters:
     - limit: Maximum number of conversations (default: 50)
-    - offset: Number of conversations to skip (default: 0)
+    - cursor: Cursor from the previous page's next_cursor (omit for the first page)
     
-    Response: List of conversations (without messages)
+    Response: List of conversations (without messages) and next_cursor (null on the last page)
     """
     try:
         # Get query parameters
         limit = min(int(request.args.get('limit', 50)), 100)  # Max 100
-        offset = int(request.args.get('offset', 0))
+        cursor = request.args.get('cursor')
         
-        # Get all conversations
-        conversations = ConversationService.get_all_conversations(
-            limit=limit,
-            offset=offset
-        )
+        # Get one page of conversations
+        try:
+            conversations, next_cursor = ConversationService.get_all_conversations(
+                limit=limit,
+                cursor=cursor
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Serialize response
         response_schema = ConversationListResponseDTO(many=True)
@@ -109,7 +111,7 @@ def list_conversations():
             'conversations': response_schema.dump(conversations_data),
             'total': len(conversations_data),
             'limit': limit,
-            'offset': offset
+            'next_cursor': next_cursor
         }), 200
         
     except Exception as e:
@@ -158,9 +160,11 @@ def stream_response(conversation_id):
             for chunk in conversation_service.stream_ai_response(conversation):
                 yield chunk
             
-            # Update conversation title if needed (async)
+            # Update conversation title if needed (in the background, after the stream closes)
             try:
-                ConversationService.update_conversation_title(conversation)
+                ConversationService.update_conversation_title_async(
+                    conversation, conversation_service.anthropic_service
+                )
             except Exception as e:
                 print(f"Failed to update conversation title: {e}")
         
@@ -216,9 +220,11 @@ def add_message(conversation_id):
             for chunk in conversation_service.stream_ai_response(conversation):
                 yield chunk
             
-            # Update conversation title if needed (async)
+            # Update conversation title if needed (in the background, after the stream closes)
             try:
-                ConversationService.update_conversation_title(conversation)
+                ConversationService.update_conversation_title_async(
+                    conversation, conversation_service.anthropic_service
+                )
             except Exception as e:
                 print(f"Failed to update conversation title: {e}")
         
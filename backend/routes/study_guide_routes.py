@@ -422,12 +422,12 @@ Please provide constructive feedback on my explanation. What did I do well? What
                     course_title=course_title,
                     active_concept=concept_title
                 ):
-                    if chunk.get('error'):
-                        yield f"data: {json.dumps({'error': chunk['error']})}\n\n"
+                    if chunk.error:
+                        yield f"data: {json.dumps({'error': chunk.error})}\n\n"
                         break
-                    elif chunk.get('content'):
-                        yield f"data: {json.dumps({'content': chunk['content']})}\n\n"
-                    elif chunk.get('is_complete'):
+                    elif chunk.content:
+                        yield f"data: {json.dumps({'content': chunk.content})}\n\n"
+                    elif chunk.is_complete:
                         yield f"data: {json.dumps({'is_complete': True})}\n\n"
                         break
                         
@@ -67,18 +67,25 @@ def generate_concept_summary():
         
         def generate():
             try:
-                accumulated_summary = ""
-                for chunk in anthropic_service.stream_concept_summary(concept_title, course_context):
+                # Only deltas go to the client; pieces are joined once for saving
+                summary_parts = []
+                for chunk in anthropic_service.stream_concept_summary(
+                    concept_title,
+                    course_context,
+                    use_cache=not force_regenerate
+                ):
                     # Accumulate content for saving
-                    if chunk.get('content'):
-                        accumulated_summary += chunk['content']
+                    if chunk.content:
+                        summary_parts.append(chunk.content)
                     
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    yield chunk.to_sse()
                     
                     # Save summary when complete
-                    if chunk.get('is_complete') and concept and course and accumulated_summary.strip():
-                        concept.set_summary(accumulated_summary.strip())
-                        course.save()
+                    if chunk.is_complete and concept and course:
+                        accumulated_summary = "".join(summary_parts).strip()
+                        if accumulated_summary:
+                            concept.set_summary(accumulated_summary)
+                            course.save()
                         
             except Exception as e:
                 error_chunk = {
@@ -179,7 +186,7 @@ def teachback_chat():
                     active_concept=active_concept,
                     message_history=message_history
                 ):
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    yield chunk.to_sse()
             except Exception as e:
                 error_chunk = {
                     'content': '',
@@ -237,7 +244,7 @@ def study_chat():
                     active_concept=active_concept,
                     message_history=message_history
                 ):
-                    yield f"data: {json.dumps(chunk)}\n\n"
+                    yield chunk.to_sse()
             except Exception as e:
                 error_chunk = {
                     'content': '',
@@ -1,19 +1,455 @@
 import os
+import re
 import json
-from typing import Generator, List, Dict, Any, Optional
-from anthropic import Anthropic
+import time
+import logging
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import ClassVar, Generator, List, Dict, Any, Optional, Tuple
+import httpx
+import orjson
+from anthropic import Anthropic, APITimeoutError, DefaultHttpxClient
+from config import Config
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+# Separate channel so per-call usage records can be routed/filtered on their own
+metrics_logger = logging.getLogger("anthropic.metrics")
+
+_WHITESPACE_RE = re.compile(r'\s')
+# Outermost JSON array in a model reply that may carry extra text around it
+_JSON_ARRAY_RE = re.compile(r'\[.*\]', re.DOTALL)
+_JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Pre-built SSE frames for StreamChunk.to_sse
+_SSE_CONTENT_FRAME = b'data: {"content":%s,"is_complete":false,"error":null}\n\n'
+_SSE_DONE_FRAME = b'data: {"content":"","is_complete":true,"error":null}\n\n'
+
+
+@dataclass(frozen=True, slots=True)
+class StreamChunk:
+    """One streamed piece of a Claude response"""
+    content: str = ''
+    is_complete: bool = False
+    error: Optional[str] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert chunk to dictionary for serialization"""
+        return {
+            'content': self.content,
+            'is_complete': self.is_complete,
+            'error': self.error
+        }
+    
+    def to_sse(self) -> bytes:
+        """Format chunk as a Server-Sent Events frame (same JSON as to_dict)"""
+        if self.error is None:
+            if not self.is_complete:
+                # Hot path: only the text needs serializing, the rest of the frame is fixed
+                return _SSE_CONTENT_FRAME % orjson.dumps(self.content)
+            if not self.content:
+                return _SSE_DONE_FRAME
+        return b"data: " + orjson.dumps(self.to_dict()) + b"\n\n"
+
+
+# Completion signal shared by every stream (chunks are immutable)
+STREAM_COMPLETE = StreamChunk(is_complete=True)
+
+# Roles allowed in the messages list (the system prompt has its own parameter)
+_VALID_ROLES = frozenset({'user', 'assistant'})
+
+
+def _filter_chat_history(message_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Keep only user/assistant turns, reduced to the role/content keys the API expects"""
+    return [
+        {'role': msg['role'], 'content': msg['content']}
+        for msg in message_history
+        if msg.get('role') in _VALID_ROLES
+    ]
+
+
+def _chat_window(message_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    Append-only window over chat history
+
+    The start index only moves in jumps of CHAT_WINDOW_MIN once the window would exceed
+    CHAT_WINDOW_MAX, so consecutive turns share a byte-identical message prefix
+    (a prompt-cache hit) instead of shifting by one message every turn.
+    """
+    overflow = len(message_history) - Config.CHAT_WINDOW_MAX
+    if overflow <= 0:
+        return message_history
+    start = -(-overflow // Config.CHAT_WINDOW_MIN) * Config.CHAT_WINDOW_MIN  # Round up to a multiple
+    return message_history[start:]
+
+
+def _with_cache_breakpoint(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Mark the last message for prompt caching so the whole prefix up to it can be reused next turn"""
+    if not messages:
+        return messages
+    last = messages[-1]
+    messages[-1] = {
+        'role': last['role'],
+        'content': [{"type": "text", "text": last['content'], "cache_control": {"type": "ephemeral"}}]
+    }
+    return messages
+
+
+def _cached_system(text: str) -> List[Dict[str, Any]]:
+    """
+    Wrap a static system prompt as a single text block marked for Anthropic prompt caching.
+    Per-request context belongs in the user message, after this block, so the prefix stays identical.
+    """
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+
+# Static system prompts, built once at import time
+_CONVERSATION_SYSTEM = _cached_system(
+    "You are Claude, a helpful AI assistant created by Anthropic. Provide helpful, accurate, and engaging responses to user questions and requests. Use markdown formatting."
+)
+
+_CONCEPT_SUMMARY_STREAM_SYSTEM = _cached_system("""You are an AI learning assistant that creates clear, comprehensive explanations of concepts for students.
+
+Your task is to provide a detailed explanation of the given concept that includes:
+1. A clear definition or overview
+2. Key principles or components
+3. Practical examples or applications
+4. Common misconceptions or pitfalls to avoid
+5. How it relates to broader topics
+
+Make your explanation:
+- Clear and accessible to learners
+- Practical with real-world examples
+- Comprehensive but not overwhelming. Don't make it too long.
+- Engaging and educational
+
+Use markdown formatting for better readability.""")
+
+_CONCEPT_SUMMARY_SYSTEM = _cached_system("""You are an AI learning assistant that creates clear, comprehensive explanations of concepts for students.
+
+Create a detailed explanation that includes:
+1. Clear definition or overview
+2. Key principles or components  
+3. Practical examples or applications
+4. Common misconceptions to avoid
+5. How it relates to broader topics
+
+Make it comprehensive but concise (aim for 200-400 words). Use markdown formatting.""")
+
+_TEACHING_QUESTIONS_SYSTEM = _cached_system("""You are an AI learning assistant that creates teaching questions for the Feynman Technique.
+
+Generate 1-3 questions that would help someone practice explaining this concept clearly. Questions should:
+1. Test understanding of core principles
+2. Encourage simple, clear explanations
+3. Identify potential knowledge gaps
+4. Be suitable for teaching to a beginner
+5. Focus on practical application
+
+Return ONLY a JSON array of question strings.""")
+
+_CONCEPT_CONTENT_SYSTEM = _cached_system("""You are an AI learning assistant that prepares study material for one concept of a course.
+
+Produce two things:
+1. "summary": a clear explanation of the concept in markdown (aim for 200-400 words) that includes a definition or overview, key principles or components, practical examples or applications, common misconceptions to avoid, and how it relates to broader topics
+2. "questions": 1-3 questions that help someone practice explaining the concept with the Feynman Technique. They should test understanding of core principles, encourage simple explanations, reveal knowledge gaps, suit teaching a beginner, and focus on practical application
+
+Respond with ONLY a valid JSON object in this format:
+{"summary": "Markdown explanation", "questions": ["Question 1", "Question 2"]}
+
+Do not include any explanations or additional text outside the JSON.""")
+
+# One worked example for the related-topics prompt: keeps the fast model on the exact JSON shape
+_RELATED_FEWSHOT = """Example:
+Course: Backend Reliability
+Description: Making web services robust in production
+
+Existing Topics:
+- Error and Exception Handling
+- Retry Strategies for HTTP Calls
+
+Output:
+[
+  {"title": "Circuit Breakers and Bulkheads", "difficulty_level": "advanced"},
+  {"title": "Idempotent API Design", "difficulty_level": "medium"},
+  {"title": "Timeouts and Deadlines", "difficulty_level": "medium"},
+  {"title": "Health Checks and Readiness Probes", "difficulty_level": "beginner"},
+  {"title": "Graceful Degradation", "difficulty_level": "advanced"}
+]"""
+
+_RELATED_TOPICS_SYSTEM = _cached_system("""You are an AI learning assistant that identifies related concepts for educational courses.
+
+Given a course and its existing topics, suggest 5-8 related topics that would complement the learning journey. These should be:
+1. Related to the existing topics but not duplicates
+2. At appropriate difficulty levels (beginner, medium, advanced)
+3. Valuable for deepening understanding of the subject area
+4. Practical and actionable learning topics
+5. Expand the learning scope without being too distant from the core topics
+
+Respond with ONLY a valid JSON array in this format:
+[
+  {
+    "title": "Related Topic Title",
+    "difficulty_level": "beginner|medium|advanced"
+  }
+]
+
+Do not include any explanations or additional text outside the JSON.
+
+""" + _RELATED_FEWSHOT)
+
+# Study chat: instructions are one static, cache-marked block; the course/concept
+# context follows as its own small block so the cached prefix never changes
+_STUDY_CHAT_SYSTEM = _cached_system("""You are an AI study assistant helping a student learn.
+
+Your role is to:
+- Answer questions clearly and helpfully
+- Provide explanations tailored to the student's current study focus
+- Offer examples and practical applications
+- Encourage learning and understanding
+- Ask follow-up questions when helpful
+- Break down complex topics into manageable parts
+
+Be supportive, educational, and engaging in your responses.""")
+
+# Teachback chat: same layout as study chat, a cache-marked static block then the context block
+_TEACHBACK_CHAT_SYSTEM = _cached_system("""You are an AI teaching assistant helping a student practice the Feynman Technique.
+
+Your role is to:
+- Provide feedback on student explanations of concepts
+- Help students improve their teaching and explanation skills
+- Ask probing questions to deepen understanding
+- Identify gaps in explanations and suggest improvements
+- Encourage clear, simple explanations that anyone could understand
+- Guide students toward mastery through teaching practice
+
+When a student submits an explanation:
+- Highlight what they explained well
+- Identify areas that need clarification or improvement
+- Ask follow-up questions to test deeper understanding
+- Suggest ways to make explanations clearer or more complete
+- Encourage them to think about how they would teach it to different audiences
+
+Be supportive but constructively critical. The goal is to help them truly master concepts by teaching them effectively.""")
+
+_REFINE_AND_EXPAND_SYSTEM = _cached_system("""You are an AI learning assistant that builds the topic list for an educational course from raw technical concepts extracted from professional conversations.
+
+Do two things in one pass:
+
+1. **Refine** the raw concepts into high-quality learning topics:
+   - Merge concepts that are too similar or overlapping
+   - Convert technical terms into clear, learnable topic titles
+   - Keep topics substantial enough for meaningful learning and connected to the original content
+   - Drop overly specific items that aren't broadly educational
+
+2. **Expand** with 5-8 related topics that complement the refined ones:
+   - Related to the refined topics but not duplicates
+   - Valuable for deepening understanding without drifting far from the core
+
+Assign each topic a difficulty level: beginner, medium, or advanced.
+
+Respond with ONLY a valid JSON object in this format:
+{
+  "refined": [{"title": "Refined Topic Title", "difficulty_level": "beginner|medium|advanced"}],
+  "related": [{"title": "Related Topic Title", "difficulty_level": "beginner|medium|advanced"}]
+}
+
+Do not include any explanations or additional text outside the JSON.""")
+
+
+_DIFFICULTY_LEVELS = frozenset({'beginner', 'medium', 'advanced'})
+
+
+def _validate_topics(topics: Any, limit: int) -> List[Dict[str, str]]:
+    """Keep well-formed {title, difficulty_level} entries from a parsed model reply"""
+    validated = []
+    if not isinstance(topics, list):
+        return validated
+    for topic in topics:
+        if isinstance(topic, dict) and 'title' in topic and topic.get('difficulty_level') in _DIFFICULTY_LEVELS:
+            # Only extract the fields we need, ignore any other fields from AI response
+            validated.append({
+                'title': str(topic['title'])[:200],  # Ensure string and truncate to max length
+                'difficulty_level': str(topic['difficulty_level'])
+            })
+    return validated[:limit]
+
+
+def _log_usage(call: str, model: str, usage: Any, started: float, first_token: Optional[float] = None):
+    """Emit one JSON metrics record per Claude call (token usage, prompt-cache hits, timing)"""
+    record = {
+        'call': call,
+        'model': model,
+        'input_tokens': getattr(usage, 'input_tokens', None),
+        'output_tokens': getattr(usage, 'output_tokens', None),
+        'cache_read_input_tokens': getattr(usage, 'cache_read_input_tokens', None),
+        'cache_creation_input_tokens': getattr(usage, 'cache_creation_input_tokens', None),
+        'duration_ms': round((time.monotonic() - started) * 1000)
+    }
+    if first_token is not None:
+        record['ttft_ms'] = round((first_token - started) * 1000)
+    metrics_logger.info(json.dumps(record))
+
+
+@lru_cache(maxsize=1024)
+def _title_for_key(client: Anthropic, model: str, key: Tuple[str, ...]) -> str:
+    """
+    Generate a conversation title from a key of truncated user messages, memoized per client
+
+    Errors are raised rather than returned so failed calls are never cached.
+    """
+    conversation_text = "\n---\n".join(key)
+    
+    system_message = "Generate a concise, descriptive title (max 50 characters) for this conversation. Return only the title, no quotes or extra text."
+    
+    user_message = f"User messages:\n{conversation_text}\n\nGenerate a title:"
+    
+    started = time.monotonic()
+    response = client.messages.create(
+        model=model,
+        max_tokens=20,
+        temperature=0.3,
+        stop_sequences=["\n"],  # A title is one line; stop as soon as it ends
+        system=system_message,
+        messages=[{"role": "user", "content": user_message}]
+    )
+    _log_usage('conversation_title', model, response.usage, started)
+    
+    title = response.content[0].text.strip()
+    
+    # Clean up the title
+    title = title.strip('"\'')  # Remove quotes
+    if len(title) > 50:
+        title = title[:47] + "..."
+    
+    return title if title else "Conversation"
+
+
+@lru_cache(maxsize=256)
+def _summarize_overflow(client: Anthropic, model: str, key: Tuple[Tuple[str, str], ...]) -> str:
+    """
+    Summarize conversation turns that fell out of the history window, memoized per client
+
+    Errors are raised rather than returned so failed calls are never cached.
+    """
+    transcript = "\n\n".join([f"{role}: {content}" for role, content in key])
+    
+    started = time.monotonic()
+    response = client.messages.create(
+        model=model,
+        max_tokens=300,
+        temperature=0.3,
+        system="Summarize the earlier part of this conversation in a short paragraph. Keep the facts, decisions and open questions the assistant needs to continue it. Return only the summary.",
+        messages=[{"role": "user", "content": transcript}]
+    )
+    _log_usage('conversation_overflow_summary', model, response.usage, started)
+    
+    return response.content[0].text.strip()
+
+
+@lru_cache(maxsize=256)
+def _truncate_tail(context: str, max_chars: int) -> str:
+    """
+    Keep roughly the last max_chars of context, starting on a word boundary
+
+    Memoized so the same context always truncates to the same object and bytes,
+    which keeps repeated prompts identical (and prompt-cacheable).
+    """
+    start = len(context) - max_chars
+    # Skip forward to the next whitespace (within a short window) to avoid a split word
+    boundary = _WHITESPACE_RE.search(context, start, start + 64)
+    if boundary:
+        start = boundary.end()
+    return "...[content truncated]...\n" + context[start:]
+
+
+@lru_cache(maxsize=1)
+def _token_encoding():
+    """
+    Load the BPE encoding used to count tokens, or None if tiktoken is unavailable
+
+    cl100k_base is not Claude's tokenizer, but it tracks it far more closely than a
+    characters/4 estimate on code and JSON. Loaded lazily since the first load may fetch the vocab file.
+    """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken unavailable, falling back to character-based token estimate: {e}")
+        return None
+
+
+# Token counts keyed by a content digest, so the cache holds 16-byte keys rather than whole contexts
+_TOKEN_COUNT_CACHE_SIZE = 4096
+_token_counts: "OrderedDict[bytes, int]" = OrderedDict()
+_token_counts_lock = threading.Lock()
+
+
+def _count_tokens_cached(text: str) -> int:
+    """Token count for text, memoized since the same contexts are counted turn after turn"""
+    encoding = _token_encoding()
+    if encoding is None:
+        # Rough approximation: 1 token ≈ 4 characters
+        return len(text) // 4
+    
+    key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    with _token_counts_lock:
+        count = _token_counts.get(key)
+        if count is not None:
+            _token_counts.move_to_end(key)
+            return count
+    
+    count = len(encoding.encode(text, disallowed_special=()))
+    with _token_counts_lock:
+        _token_counts[key] = count
+        if len(_token_counts) > _TOKEN_COUNT_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+    return count
+
+
 class AnthropicService:
     """Service for handling Anthropic API interactions with streaming support"""
     
+    # Shared across instances so per-request services reuse one connection pool
+    _client: ClassVar[Optional[Anthropic]] = None
+    _client_lock = threading.Lock()
+    
+    # Completed concept summaries keyed by prompt hash (LRU, shared across instances)
+    _summary_cache: ClassVar[OrderedDict] = OrderedDict()
+    _summary_cache_lock = threading.Lock()
+    SUMMARY_CACHE_SIZE = 512
+    
+    # Conversation history sent per turn: at most CONVERSATION_HISTORY_LIMIT messages. The cut
+    # point moves in steps of CONVERSATION_HISTORY_STEP, so the summary of the dropped turns
+    # (and the prompt prefix) stays the same for several turns in a row.
+    CONVERSATION_HISTORY_LIMIT = 12
+    CONVERSATION_HISTORY_STEP = 6
+    
+    # Per-model cap on in-flight streams per process; excess requests wait for a slot
+    # (up to STREAM_SLOT_TIMEOUT seconds) instead of piling onto the API's rate limits
+    STREAM_CONCURRENCY = {'research': 8, 'snippets': 16, 'cards': 8}
+    STREAM_SLOT_TIMEOUT = 30
+    # A stream that sends nothing (not even the API's pings) for this long is treated as stalled
+    STREAM_STALL_TIMEOUT = 30
+    # Streamed text is coalesced into chunks of at least this many chars, or whatever
+    # arrived within this many seconds, so the client gets fewer, larger SSE frames
+    STREAM_FLUSH_CHARS = 64
+    STREAM_FLUSH_SECS = 0.05
+    _stream_timeout: ClassVar[httpx.Timeout] = httpx.Timeout(60.0, connect=5.0, read=STREAM_STALL_TIMEOUT)
+    _stream_slots: ClassVar[Dict[str, threading.BoundedSemaphore]] = {
+        model_key: threading.BoundedSemaphore(limit) for model_key, limit in STREAM_CONCURRENCY.items()
+    }
+    
     def __init__(self):
         """Initialize Anthropic client"""
         api_key = os.getenv('ANTHROPIC_API_KEY')
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable is required")
         
-        self.client = Anthropic(api_key=api_key)
+        self.client = self._get_shared_client(api_key)
         
         # Model configurations
         self.models = {
@@ -21,68 +457,169 @@ class AnthropicService:
             'snippets': 'claude-3-haiku-20240307',  # Fast edits for Command-K
             'cards': 'claude-3-5-sonnet-20241022'  # Comprehensive analysis for cards
         }
+        # Bound once so per-call sites use attribute access instead of dict lookups
+        self._m_research = self.models['research']
+        self._m_snippets = self.models['snippets']
+        self._m_cards = self.models['cards']
     
+    @classmethod
+    def _get_shared_client(cls, api_key: str) -> Anthropic:
+        """Return the process-wide Anthropic client, creating it on first use"""
+        if cls._client is None:
+            with cls._client_lock:
+                if cls._client is None:
+                    cls._client = Anthropic(
+                        api_key=api_key,
+                        max_retries=2,
+                        timeout=httpx.Timeout(60.0, connect=5.0),
+                        http_client=DefaultHttpxClient(
+                            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+                        )
+                    )
+        return cls._client
     
+    @classmethod
+    def shared_client(cls) -> Anthropic:
+        """Process-wide Anthropic client for services that call the Messages API directly"""
+        return cls._get_shared_client(Config.ANTHROPIC_API_KEY)
     
     def count_tokens(self, text: str) -> int:
-        """Estimate token count for text (rough approximation)"""
-        # Rough approximation: 1 token ≈ 3.5 characters for Claude
-        return len(text) // 4
+        """Estimate token count for text (BPE count when tiktoken is installed)"""
+        return _count_tokens_cached(text)
     
-    def stream_conversation_response(
-        self, 
-        message_history: List[Dict[str, str]]
-    ) -> Generator[Dict[str, Any], None, None]:
+    @contextmanager
+    def _stream_slot(self, model_key: str):
+        """Hold one of the model's concurrent-stream slots for the duration of a stream"""
+        slot = self._stream_slots[model_key]
+        if not slot.acquire(timeout=self.STREAM_SLOT_TIMEOUT):
+            raise RuntimeError(f"Too many concurrent {model_key} streams, please try again shortly")
+        try:
+            yield
+        finally:
+            slot.release()
+    
+    @staticmethod
+    def _summary_cache_key(concept_title: str, course_context: str) -> str:
+        """Stable digest of the inputs that fully determine a concept summary prompt"""
+        return hashlib.blake2b(f"{concept_title}\x1f{course_context}".encode(), digest_size=16).hexdigest()
+    
+    def _run_stream(
+        self,
+        call: str,
+        model_key: str,
+        system: Any,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        temperature: float = 0.7
+    ) -> Generator[StreamChunk, None, None]:
         """
-        Stream Claude conversation responses
+        Stream one Claude response as StreamChunks, ending with the completion signal
+        
+        Shared by every stream_* method: holds a concurrency slot for the model,
+        records usage metrics, and turns any failure into a final error chunk.
         
         Args:
-            message_history: List of conversation messages
+            call: Name recorded in the usage metrics
+            model_key: Key into self.models
+            system: System prompt (string or list of content blocks)
+            messages: User/assistant messages in API format
+            max_tokens: Output token limit
+            temperature: Sampling temperature
             
         Yields:
-            Dict with content, is_complete, and error fields
+            StreamChunk with content, is_complete, and error fields
         """
+        model = self.models[model_key]
         try:
-            # Build conversation messages with system prompt
-            system_message = "You are Claude, a helpful AI assistant created by Anthropic. Provide helpful, accurate, and engaging responses to user questions and requests. Use markdown formatting."
-            
-            # Filter out any existing system messages and use only user/assistant messages
-            filtered_messages = []
-            for msg in message_history:
-                if msg.get('role') in ['user', 'assistant']:
-                    filtered_messages.append({
-                        'role': msg['role'],
-                        'content': msg['content']
-                    })
-            
-            # Stream response from Anthropic
-            with self.client.messages.stream(
-                model=self.models['research'],  # Use research model for conversations
-                max_tokens=2000,
-                temperature=0.7,
-                system=system_message,
-                messages=filtered_messages
+            started = time.monotonic()
+            first_token = None
+            with self._stream_slot(model_key), self.client.messages.stream(
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                system=system,
+                messages=messages,
+                timeout=self._stream_timeout
             ) as stream:
+                buf = []
+                buffered = 0
+                last_flush = started
                 for text in stream.text_stream:
-                    yield {
-                        'content': text,
-                        'is_complete': False,
-                        'error': None
-                    }
+                    now = time.monotonic()
+                    if first_token is None:
+                        first_token = now
+                    buf.append(text)
+                    buffered += len(text)
+                    if buffered >= self.STREAM_FLUSH_CHARS or now - last_flush > self.STREAM_FLUSH_SECS:
+                        yield StreamChunk(''.join(buf))
+                        buf.clear()
+                        buffered = 0
+                        last_flush = now
+                if buf:
+                    yield StreamChunk(''.join(buf))
+                _log_usage(call, model, stream.get_final_message().usage, started, first_token)
             
             # Send completion signal
-            yield {
-                'content': '',
-                'is_complete': True,
-                'error': None
-            }
+            yield STREAM_COMPLETE
             
+        except (APITimeoutError, httpx.TimeoutException):
+            # Leaving the with block closed the HTTP response, so the worker thread is free again
+            logger.warning("Stream stalled for %s after %ss without data", call, self.STREAM_STALL_TIMEOUT)
+            yield StreamChunk(is_complete=True, error='stream stalled')
         except Exception as e:
-            yield {
-                'content': '',
-                'is_complete': True,
-                'error': str(e)
-            }
+            yield StreamChunk(is_complete=True, error=str(e))
+    
+    def _bound_conversation_history(self, message_history: List[Dict[str, str]]) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+        """
+        Split history into (overflow, window): the window holds the most recent messages sent verbatim
+        
+        The window never starts with an assistant turn, since the API expects a user message first.
+        """
+        overflow_count = len(message_history) - self.CONVERSATION_HISTORY_LIMIT
+        if overflow_count <= 0:
+            return [], message_history
+        
+        step = self.CONVERSATION_HISTORY_STEP
+        start = -(-overflow_count // step) * step  # Round up to a multiple of step
+        while start < len(message_history) - 1 and message_history[start]['role'] != 'user':
+            start += 1
+        return message_history[:start], message_history[start:]
+    
+    def stream_conversation_response(
+        self, 
+        message_history: List[Dict[str, str]]
+    ) -> Generator[StreamChunk, None, None]:
+        """
+        Stream Claude conversation responses
+        
+        Long conversations send only the most recent messages; earlier turns are
+        replaced by a short, memoized summary appended to the system prompt.
+        
+        Args:
+            message_history: List of user/assistant messages in API format, as
+                produced by Message.get_message_history_for_ai (not re-filtered here)
+            
+        Yields:
+            StreamChunk with content, is_complete, and error fields
+        """
+        overflow, window = self._bound_conversation_history(message_history)
+        
+        system = _CONVERSATION_SYSTEM
+        if overflow:
+            try:
+                key = tuple((msg['role'], msg['content'][:1000]) for msg in overflow)
+                summary = _summarize_overflow(self.client, self._m_snippets, key)
+                system = _CONVERSATION_SYSTEM + [{"type": "text", "text": f"Summary of the earlier conversation:\n{summary}"}]
+            except Exception as e:
+                logger.warning(f"Error summarizing earlier conversation, sending recent messages only: {e}")
+        
+        return self._run_stream(
+            'conversation',
+            'research',  # Use research model for conversations
+            system,
+            window,
+            max_tokens=2000
+        )
     
     def generate_conversation_title(self, message_history: List[Dict[str, str]]) -> str:
         """
@@ -95,214 +632,136 @@ class AnthropicService:
             Generated title string
         """
         try:
-            # Build prompt for title generation
-            conversation_text = "\n".join([
-                f"{msg['role']}: {msg['content']}" 
-                for msg in message_history[:6]  # Use first 6 messages for title
-            ])
-            
-            system_message = "Generate a concise, descriptive title (max 50 characters) for this conversation. Return only the title, no quotes or extra text."
+            # Titles come from user intent: only user turns among the first 6, each capped
+            # at 400 chars. The same key lets re-titling an unchanged conversation skip the API call.
+            key = tuple(msg['content'][:400] for msg in message_history[:6] if msg['role'] == 'user')
+            if not key:
+                return "Conversation"
             
-            user_message = f"Conversation:\n{conversation_text}\n\nGenerate a title:"
-            
-            response = self.client.messages.create(
-                model=self.models['snippets'],  # Use faster model for title generation
-                max_tokens=20,
-                temperature=0.3,
-                system=system_message,
-                messages=[{"role": "user", "content": user_message}]
-            )
-            
-            title = response.content[0].text.strip()
-            
-            # Clean up the title
-            title = title.strip('"\'')  # Remove quotes
-            if len(title) > 50:
-                title = title[:47] + "..."
-            
-            return title if title else "Conversation"
+            # Use faster model for title generation
+            return _title_for_key(self.client, self._m_snippets, key)
             
         except Exception as e:
-            print(f"Error generating conversation title: {e}")
+            logger.warning(f"Error generating conversation title: {e}")
             return "Conversation"
     
-    def refine_original_topics(self, raw_concepts: List[str], course_title: str, course_description: str) -> List[Dict[str, str]]:
+    def generate_related_topics(self, existing_concepts: List[str], course_title: str, course_description: str) -> List[Dict[str, str]]:
         """
-        Refine raw cluster concepts into high-quality original learning topics
+        Generate related topics using existing course concepts as input
         
         Args:
-            raw_concepts: List of raw concept strings from cluster analysis
+            existing_concepts: List of current course concept titles (refined originals)
             course_title: Title of the course for context
             course_description: Description of the course for context
             
         Returns:
-            List of dictionaries with 'title' and 'difficulty_level' keys for refined original topics
+            List of dictionaries with 'title' and 'difficulty_level' keys
         """
         try:
-            # Build prompt for topic refinement
-            concepts_text = "\n".join([f"- {concept}" for concept in raw_concepts])
+            # Build prompt for related topic generation
+            concepts_text = "\n".join([f"- {concept}" for concept in existing_concepts])
             
-            system_prompt = """You are an AI learning assistant that refines raw technical concepts into high-quality learning topics.
-
-Your task is to review a list of raw concepts extracted from professional conversations and improve them for educational purposes. You should:
-
-1. **Collapse Similar Topics**: Merge concepts that are too similar or overlapping
-2. **Improve Formatting**: Convert technical terms into clear, learnable topic titles
-3. **Ensure Appropriate Granularity**: Topics should be substantial enough for meaningful learning
-4. **Maintain Relevance**: Keep topics connected to the original conversation content
-5. **Add Difficulty Levels**: Assign beginner, medium, or advanced based on complexity
-
-Guidelines:
-- Convert "database-query" → "Database Query Fundamentals"
-- Merge "error-handling" + "exception-handling" → "Error and Exception Handling"
-- Remove overly specific items that aren't broadly educational
-- Ensure each topic represents a learnable skill or concept area
-
-Respond with ONLY a valid JSON array in this format:
-[
-  {
-    "title": "Refined Topic Title",
-    "difficulty_level": "beginner|medium|advanced"
-  }
-]
-
-Do not include any explanations or additional text outside the JSON."""
-
             user_prompt = f"""Course: {course_title}
 Description: {course_description}
 
-Raw Concepts to Refine:
+Existing Topics:
 {concepts_text}
 
-Please refine these concepts into high-quality learning topics:"""
+Generate 5-8 related topics that would complement this learning path:"""
 
+            started = time.monotonic()
             response = self.client.messages.create(
-                model=self.models['research'],
+                model=self._m_snippets,
                 max_tokens=800,
-                temperature=0.3,  # Lower temperature for more consistent refinement
-                system=system_prompt,
+                temperature=0.7,
+                system=_RELATED_TOPICS_SYSTEM,
                 messages=[{"role": "user", "content": user_prompt}]
             )
+            _log_usage('generate_related_topics', self._m_snippets, response.usage, started)
             
             # Parse the JSON response
             response_text = response.content[0].text.strip()
             
             # Try to extract JSON if there's extra text
-            import json
-            import re
-            
             # Look for JSON array pattern
-            json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
+            json_match = _JSON_ARRAY_RE.search(response_text)
             if json_match:
                 response_text = json_match.group(0)
             
-            refined_topics = json.loads(response_text)
+            related_topics = orjson.loads(response_text)
             
             # Validate the response structure
-            validated_topics = []
-            for topic in refined_topics:
-                if isinstance(topic, dict) and 'title' in topic and 'difficulty_level' in topic:
-                    # Validate difficulty level
-                    if topic['difficulty_level'] in ['beginner', 'medium', 'advanced']:
-                        validated_topics.append({
-                            'title': topic['title'][:200],  # Truncate to max length
-                            'difficulty_level': topic['difficulty_level']
-                        })
-            
-            return validated_topics[:10]  # Limit to 10 refined topics max
+            return _validate_topics(related_topics, 8)  # Limit to 8 related topics max
             
         except Exception as e:
-            print(f"Error refining original topics: {e}")
-            # Fallback: return raw concepts with default difficulty
-            return [
-                {
-                    'title': concept.replace('-', ' ').title(),
-                    'difficulty_level': 'medium'
-                } for concept in raw_concepts[:10]
-            ]
+            logger.error(f"Error generating related topics: {e}")
+            return []  # Return empty list on error
 
-    def generate_related_topics(self, existing_concepts: List[str], course_title: str, course_description: str) -> List[Dict[str, str]]:
+    def refine_and_expand_topics(self, raw_concepts: List[str], course_title: str, course_description: str) -> Dict[str, List[Dict[str, str]]]:
         """
-        Generate related topics using existing course concepts as input
+        Refine raw cluster concepts and suggest related topics in a single Claude call
+        
+        Course creation needs both lists; one request avoids a second round-trip
+        and sending the course title/description twice.
         
         Args:
-            existing_concepts: List of current course concept titles (refined originals)
+            raw_concepts: List of raw concept strings from cluster analysis
             course_title: Title of the course for context
             course_description: Description of the course for context
             
         Returns:
-            List of dictionaries with 'title' and 'difficulty_level' keys
+            Dictionary with 'refined' (max 10) and 'related' (max 8) lists of
+            {'title', 'difficulty_level'} dictionaries
         """
         try:
-            # Build prompt for related topic generation
-            concepts_text = "\n".join([f"- {concept}" for concept in existing_concepts])
+            concepts_text = "\n".join([f"- {concept}" for concept in raw_concepts])
             
-            system_prompt = """You are an AI learning assistant that identifies related concepts for educational courses.
-
-Given a course and its existing topics, suggest 5-8 related topics that would complement the learning journey. These should be:
-1. Related to the existing topics but not duplicates
-2. At appropriate difficulty levels (beginner, medium, advanced)
-3. Valuable for deepening understanding of the subject area
-4. Practical and actionable learning topics
-5. Expand the learning scope without being too distant from the core topics
-
-Respond with ONLY a valid JSON array in this format:
-[
-  {
-    "title": "Related Topic Title",
-    "difficulty_level": "beginner|medium|advanced"
-  }
-]
-
-Do not include any explanations or additional text outside the JSON."""
-
             user_prompt = f"""Course: {course_title}
 Description: {course_description}
 
-Existing Topics:
+Raw Concepts to Refine:
 {concepts_text}
 
-Generate 5-8 related topics that would complement this learning path:"""
+Refine these concepts and suggest related topics:"""
 
+            started = time.monotonic()
             response = self.client.messages.create(
-                model=self.models['research'],
-                max_tokens=800,
-                temperature=0.7,
-                system=system_prompt,
+                model=self._m_snippets,
+                max_tokens=1500,
+                temperature=0.3,
+                system=_REFINE_AND_EXPAND_SYSTEM,
                 messages=[{"role": "user", "content": user_prompt}]
             )
+            _log_usage('refine_and_expand_topics', self._m_snippets, response.usage, started)
             
-            # Parse the JSON response
+            # Look for the JSON object in case there's extra text
             response_text = response.content[0].text.strip()
-            
-            # Try to extract JSON if there's extra text
-            import json
-            import re
-            
-            # Look for JSON array pattern
-            json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
+            json_match = _JSON_OBJECT_RE.search(response_text)
             if json_match:
                 response_text = json_match.group(0)
             
-            related_topics = json.loads(response_text)
+            topics = orjson.loads(response_text)
+            refined = _validate_topics(topics.get('refined'), 10)
+            if not refined:
+                raise ValueError("No valid refined topics in response")
             
-            # Validate the response structure
-            validated_topics = []
-            for topic in related_topics:
-                if isinstance(topic, dict) and 'title' in topic and 'difficulty_level' in topic:
-                    # Validate difficulty level
-                    if topic['difficulty_level'] in ['beginner', 'medium', 'advanced']:
-                        # Only extract the fields we need, ignore any other fields from AI response
-                        validated_topics.append({
-                            'title': str(topic['title'])[:200],  # Ensure string and truncate to max length
-                            'difficulty_level': str(topic['difficulty_level'])
-                        })
-            
-            return validated_topics[:8]  # Limit to 8 related topics max
+            return {
+                'refined': refined,
+                'related': _validate_topics(topics.get('related'), 8)
+            }
             
         except Exception as e:
-            print(f"Error generating related topics: {e}")
-            return []  # Return empty list on error
+            logger.error(f"Error refining and expanding topics: {e}")
+            # Fallback: raw concepts with default difficulty; related topics can be fetched later
+            return {
+                'refined': [
+                    {
+                        'title': concept.replace('-', ' ').title(),
+                        'difficulty_level': 'medium'
+                    } for concept in raw_concepts[:10]
+                ],
+                'related': []
+            }
 
     def generate_adjacent_concepts(self, existing_concepts: List[str], course_description: str) -> List[Dict[str, str]]:
         """
@@ -321,76 +780,58 @@ Generate 5-8 related topics that would complement this learning path:"""
     def stream_concept_summary(
         self, 
         concept_title: str, 
-        course_context: str = ""
-    ) -> Generator[Dict[str, Any], None, None]:
+        course_context: str = "",
+        use_cache: bool = True
+    ) -> Generator[StreamChunk, None, None]:
         """
         Stream AI-generated concept summaries for study content
         
         Args:
             concept_title: The concept to explain
             course_context: Optional course context for better explanations
+            use_cache: False skips the cached summary and asks Claude again (the fresh
+                summary still replaces the cached one)
             
         Yields:
-            Dict with content, is_complete, and error fields
+            StreamChunk with content, is_complete, and error fields
         """
-        try:
-            # Build prompt for concept explanation
-            system_message = """You are an AI learning assistant that creates clear, comprehensive explanations of concepts for students.
-
-Your task is to provide a detailed explanation of the given concept that includes:
-1. A clear definition or overview
-2. Key principles or components
-3. Practical examples or applications
-4. Common misconceptions or pitfalls to avoid
-5. How it relates to broader topics
-
-Make your explanation:
-- Clear and accessible to learners
-- Practical with real-world examples
-- Comprehensive but not overwhelming. Don't make it too long.
-- Engaging and educational
-
-Use markdown formatting for better readability."""
-
-            user_prompt = f"""Concept to explain: {concept_title}
+        cache_key = self._summary_cache_key(concept_title, course_context)
+        cached = None
+        if use_cache:
+            with self._summary_cache_lock:
+                cached = self._summary_cache.get(cache_key)
+                if cached is not None:
+                    self._summary_cache.move_to_end(cache_key)
+        if cached is not None:
+            # Same concept and context already summarized: skip Claude entirely
+            yield StreamChunk(cached)
+            yield STREAM_COMPLETE
+            return
+        
+        user_prompt = f"""Concept to explain: {concept_title}
 
 {f"Course context: {course_context}" if course_context else ""}
 
 Please provide a comprehensive explanation of this concept:"""
 
-            # Build messages array (without system message)
-            messages = [
-                {"role": "user", "content": user_prompt}
-            ]
-
-            # Stream response from Anthropic with system message as separate parameter
-            with self.client.messages.stream(
-                model=self.models['research'],
-                max_tokens=1500,
-                temperature=0.7,
-                system=system_message,
-                messages=messages
-            ) as stream:
-                for text in stream.text_stream:
-                    yield {
-                        'content': text,
-                        'is_complete': False,
-                        'error': None
-                    }
-            
-            # Send completion signal
-            yield {
-                'content': '',
-                'is_complete': True,
-                'error': None
-            }
-            
-        except Exception as e:
-            yield {
-                'content': '',
-                'is_complete': True,
-                'error': str(e)
-            }
+        parts = []
+        for chunk in self._run_stream(
+            'concept_summary_stream',
+            'research',
+            _CONCEPT_SUMMARY_STREAM_SYSTEM,
+            [{"role": "user", "content": user_prompt}],
+            max_tokens=1500
+        ):
+            if chunk is STREAM_COMPLETE:
+                # Only clean, complete summaries are cached
+                with self._summary_cache_lock:
+                    self._summary_cache[cache_key] = "".join(parts)
+                    self._summary_cache.move_to_end(cache_key)
+                    if len(self._summary_cache) > self.SUMMARY_CACHE_SIZE:
+                        self._summary_cache.popitem(last=False)
+            elif chunk.content:
+                parts.append(chunk.content)
+            yield chunk
 
     def stream_study_chat_response(
         self, 
@@ -398,7 +839,7 @@ Please provide a comprehensive explanation of this concept:"""
         course_title: str = "",
         active_concept: str = "",
         message_history: Optional[List[Dict[str, str]]] = None
-    ) -> Generator[Dict[str, Any], None, None]:
+    ) -> Generator[StreamChunk, None, None]:
         """
         Stream AI responses for study chat
         
@@ -409,75 +850,33 @@ Please provide a comprehensive explanation of this concept:"""
             message_history: Previous conversation messages
             
         Yields:
-            Dict with content, is_complete, and error fields
+            StreamChunk with content, is_complete, and error fields
         """
-        try:
-            # Build context-aware system prompt
-            context_parts = []
-            if course_title:
-                context_parts.append(f"Course: {course_title}")
-            if active_concept:
-                context_parts.append(f"Currently studying: {active_concept}")
-            
-            context_str = " | ".join(context_parts) if context_parts else "General study session"
-
-            system_message = f"""You are an AI study assistant helping a student learn. 
-
-Context: {context_str}
-
-Your role is to:
-- Answer questions clearly and helpfully
-- Provide explanations tailored to the student's current study focus
-- Offer examples and practical applications
-- Encourage learning and understanding
-- Ask follow-up questions when helpful
-- Break down complex topics into manageable parts
+        # Build the dynamic context line (sent after the cached instructions)
+        context_parts = []
+        if course_title:
+            context_parts.append(f"Course: {course_title}")
+        if active_concept:
+            context_parts.append(f"Currently studying: {active_concept}")
+        
+        context_str = " | ".join(context_parts) if context_parts else "General study session"
 
-Be supportive, educational, and engaging in your responses."""
+        system = _STUDY_CHAT_SYSTEM + [{"type": "text", "text": f"Context: {context_str}"}]
 
-            # Build message history (without system message in the messages array)
-            messages = []
-            
-            # Add conversation history
-            if message_history:
-                for msg in message_history[-10:]:  # Keep last 10 messages for context
-                    if msg.get('role') in ['user', 'assistant']:
-                        messages.append({
-                            "role": msg['role'],
-                            "content": msg['content']
-                        })
-            
-            # Add current message
-            messages.append({"role": "user", "content": message})
+        # Build message history (without system message in the messages array)
+        # from an append-only window, with the prior turns marked as a cacheable prefix
+        messages = _with_cache_breakpoint(_filter_chat_history(_chat_window(message_history))) if message_history else []
+        
+        # Add current message
+        messages.append({"role": "user", "content": message})
 
-            # Stream response from Anthropic
-            with self.client.messages.stream(
-                model=self.models['research'],
-                max_tokens=1000,
-                temperature=0.7,
-                system=system_message,
-                messages=messages
-            ) as stream:
-                for text in stream.text_stream:
-                    yield {
-                        'content': text,
-                        'is_complete': False,
-                        'error': None
-                    }
-            
-            # Send completion signal
-            yield {
-                'content': '',
-                'is_complete': True,
-                'error': None
-            }
-            
-        except Exception as e:
-            yield {
-                'content': '',
-                'is_complete': True,
-                'error': str(e)
-            }
+        return self._run_stream(
+            'study_chat',
+            'research',
+            system,
+            messages,
+            max_tokens=1000
+        )
 
     def stream_teachback_chat_response(
         self, 
@@ -485,7 +884,7 @@ Be supportive, educational, and engaging in your responses."""
         course_title: str = "",
         active_concept: str = "",
         message_history: Optional[List[Dict[str, str]]] = None
-    ) -> Generator[Dict[str, Any], None, None]:
+    ) -> Generator[StreamChunk, None, None]:
         """
         Stream AI responses for TeachBack chat (teaching assistant)
         
@@ -496,160 +895,145 @@ Be supportive, educational, and engaging in your responses."""
             message_history: Previous conversation messages
             
         Yields:
-            Dict with content, is_complete, and error fields
+            StreamChunk with content, is_complete, and error fields
         """
-        try:
-            # Build context-aware system prompt for teaching assistance
-            context_parts = []
-            if course_title:
-                context_parts.append(f"Course: {course_title}")
-            if active_concept:
-                context_parts.append(f"Teaching concept: {active_concept}")
-            
-            context_str = " | ".join(context_parts) if context_parts else "TeachBack session"
-
-            system_message = f"""You are an AI teaching assistant helping a student practice the Feynman Technique.
-
-Context: {context_str}
-
-Your role is to:
-- Provide feedback on student explanations of concepts
-- Help students improve their teaching and explanation skills
-- Ask probing questions to deepen understanding
-- Identify gaps in explanations and suggest improvements
-- Encourage clear, simple explanations that anyone could understand
-- Guide students toward mastery through teaching practice
-
-When a student submits an explanation:
-- Highlight what they explained well
-- Identify areas that need clarification or improvement
-- Ask follow-up questions to test deeper understanding
-- Suggest ways to make explanations clearer or more complete
-- Encourage them to think about how they would teach it to different audiences
+        # Build the dynamic context line (sent after the cached instructions)
+        context_parts = []
+        if course_title:
+            context_parts.append(f"Course: {course_title}")
+        if active_concept:
+            context_parts.append(f"Teaching concept: {active_concept}")
+        
+        context_str = " | ".join(context_parts) if context_parts else "TeachBack session"
 
-Be supportive but constructively critical. The goal is to help them truly master concepts by teaching them effectively."""
+        system = _TEACHBACK_CHAT_SYSTEM + [{"type": "text", "text": f"Context: {context_str}"}]
 
-            # Build message history (without system message in the messages array)
-            messages = []
-            
-            # Add conversation history
-            if message_history:
-                for msg in message_history[-10:]:  # Keep last 10 messages for context
-                    if msg.get('role') in ['user', 'assistant']:
-                        messages.append({
-                            "role": msg['role'],
-                            "content": msg['content']
-                        })
-            
-            # Add current message
-            messages.append({"role": "user", "content": message})
+        # Build message history (without system message in the messages array)
+        # from an append-only window, with the prior turns marked as a cacheable prefix
+        messages = _with_cache_breakpoint(_filter_chat_history(_chat_window(message_history))) if message_history else []
+        
+        # Add current message
+        messages.append({"role": "user", "content": message})
 
-            # Stream response from Anthropic
-            with self.client.messages.stream(
-                model=self.models['research'],
-                max_tokens=1200,
-                temperature=0.7,
-                system=system_message,
-                messages=messages
-            ) as stream:
-                for text in stream.text_stream:
-                    yield {
-                        'content': text,
-                        'is_complete': False,
-                        'error': None
-                    }
-            
-            # Send completion signal
-            yield {
-                'content': '',
-                'is_complete': True,
-                'error': None
-            }
-            
-        except Exception as e:
-            yield {
-                'content': '',
-                'is_complete': True,
-                'error': str(e)
-            }
+        return self._run_stream(
+            'teachback_chat',
+            'research',
+            system,
+            messages,
+            max_tokens=1200
+        )
 
     def generate_concept_summary(self, concept_title: str, course_context: str = "") -> str:
         """Generate concept summary (non-streaming)"""
         try:
-            system_message = """You are an AI learning assistant that creates clear, comprehensive explanations of concepts for students.
-
-Create a detailed explanation that includes:
-1. Clear definition or overview
-2. Key principles or components  
-3. Practical examples or applications
-4. Common misconceptions to avoid
-5. How it relates to broader topics
-
-Make it comprehensive but concise (aim for 200-400 words). Use markdown formatting."""
-
             user_prompt = f"""Concept: {concept_title}
 {f"Course context: {course_context}" if course_context else ""}
 
 Provide a comprehensive explanation:"""
 
+            started = time.monotonic()
             response = self.client.messages.create(
-                model=self.models['research'],
+                model=self._m_research,
                 max_tokens=800,
                 temperature=0.7,
-                system=system_message,
+                system=_CONCEPT_SUMMARY_SYSTEM,
                 messages=[{"role": "user", "content": user_prompt}]
             )
+            _log_usage('concept_summary', self._m_research, response.usage, started)
             
             return response.content[0].text.strip()
             
         except Exception as e:
-            print(f"Error generating concept summary: {e}")
+            logger.error(f"Error generating concept summary: {e}")
             return f"Error generating summary for {concept_title}"
 
     def generate_teaching_questions(self, concept_title: str, summary: str = "") -> List[str]:
         """Generate teaching questions for Feynman technique (non-streaming)"""
         try:
-            system_message = """You are an AI learning assistant that creates teaching questions for the Feynman Technique.
-
-Generate 1-3 questions that would help someone practice explaining this concept clearly. Questions should:
-1. Test understanding of core principles
-2. Encourage simple, clear explanations
-3. Identify potential knowledge gaps
-4. Be suitable for teaching to a beginner
-5. Focus on practical application
-
-Return ONLY a JSON array of question strings."""
-
             context = summary if summary else f"Concept: {concept_title}"
             user_prompt = f"""Context: {context}
 
 Generate teaching questions for: {concept_title}"""
 
+            started = time.monotonic()
             response = self.client.messages.create(
-                model=self.models['research'],
+                model=self._m_research,
                 max_tokens=400,
                 temperature=0.7,
-                system=system_message,
+                system=_TEACHING_QUESTIONS_SYSTEM,
                 messages=[{"role": "user", "content": user_prompt}]
             )
+            _log_usage('teaching_questions', self._m_research, response.usage, started)
             
             # Parse JSON response
-            import json
-            import re
-            
             response_text = response.content[0].text.strip()
-            json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
+            json_match = _JSON_ARRAY_RE.search(response_text)
             if json_match:
-                questions = json.loads(json_match.group(0))
+                questions = orjson.loads(json_match.group(0))
                 return [q for q in questions if isinstance(q, str)][:3]  # Max 3 questions
             
             # Fallback if JSON parsing fails
             return [f"How would you explain {concept_title} to someone who has never heard of it?"]
             
         except Exception as e:
-            print(f"Error generating teaching questions: {e}")
+            logger.error(f"Error generating teaching questions: {e}")
             return [f"How would you explain {concept_title} to someone who has never heard of it?"]
 
+    def generate_concept_content(self, concept_title: str, course_context: str = "") -> Dict[str, Any]:
+        """
+        Generate a concept summary and its teaching questions in one call (non-streaming)
+        
+        Background content generation needs both for each concept; one request per
+        concept halves the round-trips while concepts still run in parallel.
+        
+        Args:
+            concept_title: The concept to explain
+            course_context: Optional course context for better explanations
+            
+        Returns:
+            Dictionary with 'summary' (str) and 'questions' (list of str)
+        """
+        try:
+            user_prompt = f"""Concept: {concept_title}
+{f"Course context: {course_context}" if course_context else ""}
+
+Provide the summary and teaching questions:"""
+
+            started = time.monotonic()
+            response = self.client.messages.create(
+                model=self._m_research,
+                max_tokens=1200,
+                temperature=0.7,
+                system=_CONCEPT_CONTENT_SYSTEM,
+                messages=[{"role": "user", "content": user_prompt}]
+            )
+            _log_usage('concept_content', self._m_research, response.usage, started)
+            
+            # Look for the JSON object in case there's extra text
+            response_text = response.content[0].text.strip()
+            json_match = _JSON_OBJECT_RE.search(response_text)
+            if json_match:
+                response_text = json_match.group(0)
+            
+            content = orjson.loads(response_text)
+            summary = str(content.get('summary') or '').strip()
+            if not summary:
+                raise ValueError("No summary in response")
+            questions = [q for q in content.get('questions') or [] if isinstance(q, str)][:3]  # Max 3 questions
+            
+            return {
+                'summary': summary,
+                'questions': questions or [f"How would you explain {concept_title} to someone who has never heard of it?"]
+            }
+            
+        except Exception as e:
+            logger.error(f"Error generating concept content, falling back to separate calls: {e}")
+            summary = self.generate_concept_summary(concept_title, course_context)
+            return {
+                'summary': summary,
+                'questions': self.generate_teaching_questions(concept_title, summary)
+            }
+
     def truncate_context(self, context: str, max_tokens: int = 3000) -> str:
         """Truncate context to fit within token limits"""
         estimated_tokens = self.count_tokens(context)
@@ -658,8 +1042,14 @@ Generate teaching questions for: {concept_title}"""
             return context
         
         # Truncate from the beginning, keeping the most recent content
-        target_chars = max_tokens * 4
-        if len(context) > target_chars:
-            return "...[content truncated]...\n" + context[-target_chars:]
+        encoding = _token_encoding()
+        if encoding is None:
+            target_chars = max_tokens * 4
+            if len(context) > target_chars:
+                return _truncate_tail(context, target_chars)
+            return context
         
-        return context
+        # Cut on a real token boundary: keep exactly the last max_tokens tokens
+        tokens = encoding.encode(context, disallowed_special=())
+        # A token split inside a multi-byte character decodes to U+FFFD; drop it
+        return "...[content truncated]...\n" + encoding.decode(tokens[-max_tokens:]).lstrip('\ufffd')
@@ -1,6 +1,8 @@
+import time
 import threading
 import logging
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
 from typing import Optional
 from models.message import Message
 from models.cluster import ClusteringRun
@@ -10,12 +12,23 @@ from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Settings are fixed for the process lifetime, so they are resolved once at import
+_ENABLED = getattr(Config, 'BACKGROUND_CLUSTERING_ENABLED', True)
+_MESSAGE_THRESHOLD = getattr(Config, 'CLUSTERING_MESSAGE_THRESHOLD', 1)
+_TIME_THRESHOLD_MINUTES = getattr(Config, 'CLUSTERING_TIME_THRESHOLD_MINUTES', 5)
+_ANALYSIS_WORKERS = getattr(Config, 'ANALYSIS_WORKERS', 4)
+
 class BackgroundClusteringService:
     """Service for managing background clustering operations triggered by new messages"""
     
     _instance = None
     _lock = threading.Lock()
     
+    # Within this many seconds of a clustering check, further message triggers skip the check
+    DEBOUNCE_SECS = 5
+    # Status counters are reused for this many seconds (shared by trigger checks and status polls)
+    STAT_TTL_SECS = 2
+    
     def __new__(cls):
         """Singleton pattern to ensure only one instance manages clustering"""
         if cls._instance is None:
@@ -36,68 +49,78 @@ class BackgroundClusteringService:
         self._clustering_lock = threading.Lock()
         self._clustering_in_progress = False
         self._last_clustering_check = None
+        self._trigger_lock = threading.Lock()
+        self._last_trigger_ts = 0.0
+        self._stat_cache = {}
+        
+        # Bounded pool for per-message analysis: bursts queue up instead of spawning a thread each
+        self._analysis_executor = ThreadPoolExecutor(
+            max_workers=_ANALYSIS_WORKERS,
+            thread_name_prefix='clustering-analysis'
+        )
         
         # Configuration
-        self.enabled = getattr(Config, 'BACKGROUND_CLUSTERING_ENABLED', True)
-        self.message_threshold = getattr(Config, 'CLUSTERING_MESSAGE_THRESHOLD', 1)
-        self.time_threshold_minutes = getattr(Config, 'CLUSTERING_TIME_THRESHOLD_MINUTES', 5)
+        self.enabled = _ENABLED
+        self.message_threshold = _MESSAGE_THRESHOLD
+        self.time_threshold_minutes = _TIME_THRESHOLD_MINUTES
         
         self._initialized = True
-        logger.info(f"BackgroundClusteringService initialized - enabled: {self.enabled}, "
-                   f"message_threshold: {self.message_threshold}, "
-                   f"time_threshold: {self.time_threshold_minutes}min")
+        logger.info("BackgroundClusteringService initialized - enabled: %s, "
+                    "message_threshold: %s, time_threshold: %smin",
+                    self.enabled, self.message_threshold, self.time_threshold_minutes)
     
     def trigger_background_analysis(self, message_id: str):
         """
         Trigger background analysis for a new message
         This is the main entry point called when new messages are created
         """
-        logger.info(f"See if background clustering is enabled for {message_id}")
+        logger.debug("See if background clustering is enabled for %s", message_id)
         if not self.enabled:
             logger.debug("Background clustering is disabled")
             return
         
-        logger.info(f"Triggering background analysis for message {message_id}")
+        logger.debug("Triggering background analysis for message %s", message_id)
         
-        # Start background thread
-        thread = threading.Thread(
-            target=self._analyze_and_maybe_cluster,
-            args=(message_id,),
-            daemon=True,  # Dies when main process dies
-            name=f"clustering-analysis-{message_id[:8]}"
-        )
-        thread.start()
+        # Queue on the analysis pool
+        self._analysis_executor.submit(self._analyze_and_maybe_cluster, message_id)
     
     def _analyze_and_maybe_cluster(self, message_id: str):
         """
         Background thread function that analyzes a message and triggers clustering if needed
         """
         try:
-            logger.info(f"Starting background analysis for message {message_id}")
+            logger.debug("Starting background analysis for message %s", message_id)
             
             # Step 1: Analyze the new message for concepts and embeddings
             message = Message.objects(message_id=message_id).first()
             if not message:
-                logger.warning(f"Message {message_id} not found for analysis")
+                logger.warning("Message %s not found for analysis", message_id)
                 return
             
             # Analyze the message
             analysis_success = self.message_analysis_service.analyze_message(message)
             if analysis_success:
-                logger.info(f"Successfully analyzed message {message_id}")
+                logger.debug("Successfully analyzed message %s", message_id)
             else:
-                logger.warning(f"Failed to analyze message {message_id}")
+                logger.warning("Failed to analyze message %s", message_id)
+            
+            # Step 2: Check if we should trigger clustering, once per burst of messages
+            with self._trigger_lock:
+                now = time.monotonic()
+                if now - self._last_trigger_ts < self.DEBOUNCE_SECS:
+                    logger.debug("Clustering check debounced for message %s", message_id)
+                    return
+                self._last_trigger_ts = now
             
-            # Step 2: Check if we should trigger clustering
             should_cluster, reason = self._should_trigger_clustering()
             if should_cluster:
-                logger.info(f"Triggering clustering: {reason}")
+                logger.info("Triggering clustering: %s", reason)
                 self._run_clustering_if_not_in_progress()
             else:
-                logger.debug(f"Clustering not triggered: {reason}")
+                logger.debug("Clustering not triggered: %s", reason)
                 
         except Exception as e:
-            logger.error(f"Background analysis failed for message {message_id}: {str(e)}")
+            logger.error("Background analysis failed for message %s: %s", message_id, e)
     
     def _should_trigger_clustering(self) -> tuple:
         """
@@ -110,45 +133,68 @@ class BackgroundClusteringService:
             if unprocessed_count >= self.message_threshold:
                 return True, f"{unprocessed_count} unprocessed messages (threshold: {self.message_threshold})"
             
-            # Check 2: Time since last clustering
+            # Check 2: Time since last clustering (the latest-run lookup also covers "no runs yet",
+            # which reports infinite minutes, so no separate existence query is needed)
             minutes_since_last = self._minutes_since_last_clustering()
+            if minutes_since_last == float('inf'):
+                return True, "No clustering runs exist yet"
             if minutes_since_last >= self.time_threshold_minutes:
                 return True, f"{minutes_since_last} minutes since last clustering (threshold: {self.time_threshold_minutes})"
             
-            # Check 3: No clustering runs exist yet
-            if not ClusteringRun.objects.first():
-                total_messages = Message.objects.count()
-                if total_messages >= 2:  # Need at least 2 messages to cluster
-                    return True, "No clustering runs exist and have sufficient messages"
-            
             return False, f"Conditions not met - unprocessed: {unprocessed_count}, minutes: {minutes_since_last}"
             
         except Exception as e:
-            logger.error(f"Error checking clustering conditions: {str(e)}")
+            logger.error("Error checking clustering conditions: %s", e)
             return False, f"Error checking conditions: {str(e)}"
     
+    def _cached(self, key: str, ttl: float, fn):
+        """Return fn(), reusing the last value for ttl seconds (errors are never cached)"""
+        now = time.monotonic()
+        entry = self._stat_cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+        value = fn()
+        self._stat_cache[key] = (now + ttl, value)
+        return value
+    
     def _count_unprocessed_messages(self) -> int:
-        """Count messages that haven't been processed for clustering"""
+        """
+        Count messages that haven't been processed for clustering
+        Hinted onto the processed_for_clustering index declared on Message so the
+        count is answered from the index instead of a collection scan
+        """
         try:
-            return Message.objects(processed_for_clustering=False).count()
+            return self._cached(
+                'unprocessed_messages',
+                self.STAT_TTL_SECS,
+                lambda: Message.objects(processed_for_clustering=False)
+                    .hint([('processed_for_clustering', 1)])
+                    .count()
+            )
         except Exception as e:
-            logger.error(f"Error counting unprocessed messages: {str(e)}")
+            logger.error("Error counting unprocessed messages: %s", e)
             return 0
     
     def _minutes_since_last_clustering(self) -> int:
         """Get minutes since the last clustering run"""
         try:
-            latest_run = ClusteringRun.objects.order_by('-created_at').first()
-            if not latest_run:
-                return float('inf')  # No clustering runs yet
-            
-            time_diff = datetime.utcnow() - latest_run.created_at
-            return int(time_diff.total_seconds() / 60)
+            return self._cached('minutes_since_last_clustering', self.STAT_TTL_SECS, self._compute_minutes_since_last_clustering)
             
         except Exception as e:
-            logger.error(f"Error calculating time since last clustering: {str(e)}")
+            logger.error("Error calculating time since last clustering: %s", e)
             return 0
     
+    def _compute_minutes_since_last_clustering(self):
+        """Query the latest clustering run and return whole minutes since it was created"""
+        # Only created_at is needed; the created_at index serves the descending sort
+        latest_run = ClusteringRun.objects.order_by('-created_at').only('created_at').first()
+        if not latest_run:
+            return float('inf')  # No clustering runs yet
+        
+        # created_at is stored as naive UTC, so pin the zone before taking the epoch time
+        created_ts = latest_run.created_at.replace(tzinfo=timezone.utc).timestamp()
+        return int((time.time() - created_ts) / 60)
+    
     def _run_clustering_if_not_in_progress(self):
         """
         Run clustering if not already in progress
@@ -156,7 +202,7 @@ class BackgroundClusteringService:
         """
         with self._clustering_lock:
             if self._clustering_in_progress:
-                logger.info("Clustering already in progress, skipping")
+                logger.debug("Clustering already in progress, skipping")
                 return
             
             self._clustering_in_progress = True
@@ -170,7 +216,7 @@ class BackgroundClusteringService:
                     logger.error("Background clustering failed")
                     
             except Exception as e:
-                logger.error(f"Error during background clustering: {str(e)}")
+                logger.error("Error during background clustering: %s", e)
                 
             finally:
                 self._clustering_in_progress = False
@@ -204,7 +250,7 @@ class BackgroundClusteringService:
             }
             
         except Exception as e:
-            logger.error(f"Error getting background clustering status: {str(e)}")
+            logger.error("Error getting background clustering status: %s", e)
             return {
                 'enabled': self.enabled,
                 'error': str(e)
@@ -226,3 +272,7 @@ class BackgroundClusteringService:
         )
         thread.start()
         return True
+    
+    def shutdown(self):
+        """Shutdown the analysis thread pool executor"""
+        self._analysis_executor.shutdown(wait=True)
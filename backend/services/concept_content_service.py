@@ -2,8 +2,9 @@ import threading
 import logging
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List
+from typing import ClassVar, List, Set, Tuple
 
+from config import Config
 from models.course import Course
 from services.anthropic_service import AnthropicService
 
@@ -14,106 +15,148 @@ logger = logging.getLogger(__name__)
 class ConceptContentService:
     """Service for generating concept summaries and teaching questions in background threads"""
     
+    # (course_id, concept_title, kind) jobs queued or running; class-level because a new
+    # service instance is created for every review request
+    _inflight: ClassVar[Set[Tuple[str, str, str]]] = set()
+    _inflight_lock = threading.Lock()
+    
+    # One pool for every course. The jobs only wait on Claude, so it is sized well past the
+    # core count; a pool per instance leaked 10 idle threads per review request.
+    executor: ClassVar[ThreadPoolExecutor] = ThreadPoolExecutor(
+        max_workers=getattr(Config, 'CONCEPT_CONTENT_WORKERS', 32),
+        thread_name_prefix='concept-content'
+    )
+    
     def __init__(self, anthropic_service: AnthropicService):
         self.anthropic_service = anthropic_service
-        self.executor = ThreadPoolExecutor(max_workers=10)  # Configurable
         
     def generate_concept_content_batch(self, course_id: str, concept_titles: List[str]):
         """Start background generation for multiple concepts"""
         try:
             course = Course.objects.get(id=course_id)
+            concept_map = course.get_concept_map()
             
             for concept_title in concept_titles:
-                concept = course.get_concept_by_title(concept_title)
+                concept = concept_map.get(concept_title)
                 if not concept:
-                    logger.warning(f"Concept not found: {concept_title}")
+                    logger.warning("Concept not found: %s", concept_title)
                     continue
                 
+                # Claim each missing part (skipped if already queued or running)
+                need_summary = concept.should_generate_summary() and self._claim(course_id, concept_title, 'summary')
+                need_questions = concept.should_generate_questions() and self._claim(course_id, concept_title, 'questions')
+                
+                if need_summary and need_questions:
+                    # Both missing: one worker fetches summary and questions in a single call
+                    logger.debug("Starting summary and questions generation for: %s", concept_title)
+                    self.executor.submit(
+                        self._generate_content_worker,
+                        course_id,
+                        concept_title,
+                        course.description
+                    )
+                    
                 # Start summary thread if needed
-                if concept.should_generate_summary():
-                    logger.info(f"Starting summary generation for: {concept_title}")
+                elif need_summary:
+                    logger.debug("Starting summary generation for: %s", concept_title)
                     self.executor.submit(
                         self._generate_summary_worker, 
                         course_id, 
-                        concept_title
+                        concept_title,
+                        course.description
                     )
                     
                 # Start questions thread if needed  
-                if concept.should_generate_questions():
-                    logger.info(f"Starting questions generation for: {concept_title}")
+                elif need_questions:
+                    logger.debug("Starting questions generation for: %s", concept_title)
                     self.executor.submit(
                         self._generate_questions_worker, 
                         course_id, 
-                        concept_title
+                        concept_title,
+                        course.label,
+                        course.description,
+                        concept.summary
                     )
                     
         except Exception as e:
-            logger.error(f"Error starting batch generation for course {course_id}: {e}")
+            logger.error("Error starting batch generation for course %s: %s", course_id, e)
     
-    def _generate_summary_worker(self, course_id: str, concept_title: str):
-        """Background worker for summary generation"""
+    def _claim(self, course_id: str, concept_title: str, kind: str) -> bool:
+        """Mark a job as in flight; False if the same job is already queued or running"""
+        key = (str(course_id), concept_title, kind)
+        with self._inflight_lock:
+            if key in self._inflight:
+                logger.debug("%s generation already in flight: %s", kind.capitalize(), concept_title)
+                return False
+            self._inflight.add(key)
+            return True
+    
+    def _release(self, course_id: str, concept_title: str, kind: str):
+        """Clear a finished job's in-flight mark"""
+        with self._inflight_lock:
+            self._inflight.discard((str(course_id), concept_title, kind))
+    
+    # Workers get what they need from the course the dispatcher already loaded, so they never
+    # read the course themselves; the in-flight claims keep duplicates out, and the final
+    # conditional update skips the write if a streaming endpoint took over meanwhile.
+    
+    def _generate_content_worker(self, course_id: str, concept_title: str, course_description: str):
+        """Background worker for summary and questions generation in one Claude call"""
         try:
-            # Reload fresh data in this thread
-            course = Course.objects.get(id=course_id)
-            concept = course.get_concept_by_title(concept_title)
+            logger.debug("Generating summary and questions for concept: %s", concept_title)
             
-            if not concept:
-                logger.warning(f"Concept not found in worker: {concept_title}")
-                return
+            content = self.anthropic_service.generate_concept_content(
+                concept_title,
+                course_description
+            )
             
-            # Double-check if still needed (race condition protection)
-            if not concept.should_generate_summary():
-                logger.info(f"Summary generation no longer needed: {concept_title}")
-                return
+            # Save each part only if it is not currently streaming (checked atomically in the update)
+            if not Course.set_concept_summary_if_idle(course_id, concept_title, content['summary']):
+                logger.debug("Summary not saved (streaming active or concept removed): %s", concept_title)
+            if not Course.set_concept_questions_if_idle(course_id, concept_title, content['questions']):
+                logger.debug("Questions not saved (streaming active or concept removed): %s", concept_title)
+            logger.debug("Content generation finished for concept: %s", concept_title)
                 
-            logger.info(f"Generating summary for concept: {concept_title}")
+        except Exception as e:
+            logger.error("Error generating content for %s: %s", concept_title, e)
+        finally:
+            self._release(course_id, concept_title, 'summary')
+            self._release(course_id, concept_title, 'questions')
+    
+    def _generate_summary_worker(self, course_id: str, concept_title: str, course_description: str):
+        """Background worker for summary generation"""
+        try:
+            logger.debug("Generating summary for concept: %s", concept_title)
             
             # Generate summary
             summary = self.anthropic_service.generate_concept_summary(
                 concept_title, 
-                course.description
+                course_description
             )
             
-            # Reload course again to check streaming flag
-            course = Course.objects.get(id=course_id)
-            concept = course.get_concept_by_title(concept_title)
-            
-            if not concept:
-                logger.warning(f"Concept disappeared during generation: {concept_title}")
-                return
-            
-            # Only save if not currently streaming
-            if not getattr(concept, 'is_streaming_summary', False):
-                concept.set_summary(summary)
-                course.save()
-                logger.info(f"Summary saved for concept: {concept_title}")
+            # Only save if not currently streaming (checked atomically in the update)
+            if Course.set_concept_summary_if_idle(course_id, concept_title, summary):
+                logger.debug("Summary saved for concept: %s", concept_title)
             else:
-                logger.info(f"Summary generation cancelled (streaming active): {concept_title}")
+                logger.debug("Summary generation cancelled (streaming active or concept removed): %s", concept_title)
                 
         except Exception as e:
-            logger.error(f"Error generating summary for {concept_title}: {e}")
+            logger.error("Error generating summary for %s: %s", concept_title, e)
+        finally:
+            self._release(course_id, concept_title, 'summary')
     
-    def _generate_questions_worker(self, course_id: str, concept_title: str):
+    def _generate_questions_worker(
+        self,
+        course_id: str,
+        concept_title: str,
+        course_label: str,
+        course_description: str,
+        concept_summary: str
+    ):
         """Background worker for questions generation"""
         try:
-            # Reload fresh data in this thread
-            course = Course.objects.get(id=course_id)
-            course_label = getattr(course, 'label', None)
-            course_description = getattr(course, 'description', None)
-            concept = course.get_concept_by_title(concept_title)
+            logger.debug("Generating questions for concept: %s", concept_title)
             
-            if not concept:
-                logger.warning(f"Concept not found in worker: {concept_title}")
-                return
-            
-            # Double-check if still needed
-            if not concept.should_generate_questions():
-                logger.info(f"Questions generation no longer needed: {concept_title}")
-                return
-                
-            logger.info(f"Generating questions for concept: {concept_title}")
-            
-            concept_summary = getattr(concept, 'summary', None)
             context = (
                 f"Course title: {course_label}\n"
                 f"Course description: {course_description}\n"
@@ -125,27 +168,18 @@ class ConceptContentService:
                 concept_title, 
                 str(context)
             )
-            print(f"Questions generated: {questions}")
-            
-            # Reload course again to check streaming flag
-            course = Course.objects.get(id=course_id)
-            concept = course.get_concept_by_title(concept_title)
-            
-            if not concept:
-                logger.warning(f"Concept disappeared during generation: {concept_title}")
-                return
             
-            # Only save if not currently streaming
-            if not getattr(concept, 'is_streaming_questions', False):
-                concept.set_teaching_questions(questions)
-                course.save()
-                logger.info(f"Questions saved for concept: {concept_title}")
+            # Only save if not currently streaming (checked atomically in the update)
+            if Course.set_concept_questions_if_idle(course_id, concept_title, questions):
+                logger.debug("Questions saved for concept: %s", concept_title)
             else:
-                logger.info(f"Questions generation cancelled (streaming active): {concept_title}")
+                logger.debug("Questions generation cancelled (streaming active or concept removed): %s", concept_title)
                 
         except Exception as e:
-            logger.error(f"Error generating questions for {concept_title}: {e}")
+            logger.error("Error generating questions for %s: %s", concept_title, e)
+        finally:
+            self._release(course_id, concept_title, 'questions')
     
     def shutdown(self):
-        """Shutdown the thread pool executor"""
+        """Shutdown the shared thread pool executor (only at process exit)"""
         self.executor.shutdown(wait=True)
@@ -1,11 +1,20 @@
+import re
 import json
+import time
 import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
 import numpy as np
-from typing import List, Dict, Optional, Tuple
-from sklearn.cluster import KMeans
-from sklearn.metrics.pairwise import cosine_similarity
-from anthropic import Anthropic
+import orjson
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import ClassVar, List, Dict, Optional, Tuple
+from scipy import sparse
+from services.anthropic_service import AnthropicService
 from models.conversation import Conversation
+from models.message import Message
 from models.cluster import ConversationCluster, ClusteringRun
 from services.message_analysis_service import MessageAnalysisService
 from config import Config
@@ -15,11 +24,132 @@ from sklearn.metrics import calinski_harabasz_score
 
 logger = logging.getLogger(__name__)
 
+# Outermost JSON object in a labeling reply that may carry extra text around it
+_JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+
+@dataclass
+class ConversationBatch:
+    """
+    Clustering inputs as parallel per-conversation arrays: row i of E belongs to ids[i]
+    
+    E holds the L2-normalized float32 conversation embeddings, so cosine similarity is a
+    plain dot product.
+    """
+    ids: List[str]
+    titles: List[str]
+    E: np.ndarray
+    concepts: List[List[str]]
+    created_at: List[datetime]
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def _kmeans_plus_plus(X_norm: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+    """k-means++ seeding on unit vectors (1 - cosine is half the squared Euclidean distance)"""
+    n = X_norm.shape[0]
+    centers = np.empty((k, X_norm.shape[1]), dtype=X_norm.dtype)
+    centers[0] = X_norm[rng.integers(n)]
+    dist = 1.0 - X_norm @ centers[0]
+    for j in range(1, k):
+        weights = np.clip(dist, 0.0, None)
+        total = weights.sum()
+        idx = rng.choice(n, p=weights / total) if total > 0 else rng.integers(n)
+        centers[j] = X_norm[idx]
+        dist = np.minimum(dist, 1.0 - X_norm @ centers[j])
+    return centers
+
+
+def _spherical_kmeans(
+    X_norm: np.ndarray,
+    k: int,
+    init: Optional[np.ndarray] = None,
+    seed: int = 42,
+    max_iter: int = 100,
+    tol: float = 1e-6
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Spherical k-means on L2-normalized rows, i.e. k-means under cosine similarity
+    
+    Each Lloyd step is two matrix products: X @ C.T scores every point against every
+    centroid, and the sparse one-hot assignment matrix R^T @ X sums each cluster's
+    members. Centroids are renormalized after every update; iteration stops once the
+    mean centroid movement (1 - cosine) drops below tol.
+    
+    Returns (labels, centers)
+    """
+    n = X_norm.shape[0]
+    rng = np.random.default_rng(seed)
+    C = _kmeans_plus_plus(X_norm, k, rng) if init is None else np.array(init, dtype=X_norm.dtype)
+    ones = np.ones(n, dtype=X_norm.dtype)
+    rows = np.arange(n)
+    
+    for _ in range(max_iter):
+        labels = (X_norm @ C.T).argmax(axis=1)
+        R_hat = sparse.csr_matrix((ones, (rows, labels)), shape=(n, k))
+        C_new = np.asarray(R_hat.T @ X_norm)
+        
+        # Reseed empty clusters with the points least similar to their own centroid
+        empty = ~R_hat.getnnz(axis=0).astype(bool)
+        if empty.any():
+            worst = np.argsort((X_norm * C[labels]).sum(axis=1))[:int(empty.sum())]
+            C_new[empty] = X_norm[worst]
+        
+        norms = np.linalg.norm(C_new, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        C_new /= norms
+        
+        shift = 1.0 - (C_new * C).sum(axis=1).mean()
+        C = C_new
+        if shift < tol:
+            break
+    
+    labels = (X_norm @ C.T).argmax(axis=1)
+    return labels, C
+
+
+def _split_worst_cluster(X_norm: np.ndarray, labels: np.ndarray, centers: np.ndarray) -> Optional[np.ndarray]:
+    """
+    k+1 initial centroids from a k-cluster fit: the cluster with the highest within-cluster
+    cosine error is replaced by two centroids on either side of its first principal direction
+    
+    Returns None if no cluster has spread to split along.
+    """
+    errors = np.bincount(labels, weights=1.0 - (X_norm * centers[labels]).sum(axis=1), minlength=len(centers))
+    worst = int(errors.argmax())
+    members = X_norm[labels == worst]
+    if len(members) < 2 or errors[worst] <= 0:
+        return None
+    
+    _, singular_values, vt = np.linalg.svd(members - members.mean(axis=0), full_matrices=False)
+    offset = vt[0] * (singular_values[0] / np.sqrt(len(members)))
+    split = np.stack([centers[worst] + offset, centers[worst] - offset])
+    split /= np.linalg.norm(split, axis=1, keepdims=True)
+    
+    new_centers = np.vstack([np.delete(centers, worst, axis=0), split])
+    return new_centers.astype(X_norm.dtype, copy=False)
+
+
 class ConversationClusteringService:
     """Service for clustering conversations based on semantic similarity"""
     
+    # Cluster labels go through the Message Batches API; fall back to direct calls if the
+    # batch has not ended within this long
+    LABEL_BATCH_TIMEOUT_SECS = 300
+    LABEL_BATCH_POLL_SECS = 5
+    # Silhouette scores in the k sweep are estimated on at most this many conversations
+    SILHOUETTE_SAMPLE_SIZE = 2000
+    
+    # AI labels by sorted top-8 concepts (the ones the prompt shows), shared by all instances;
+    # reclustering mostly reproduces the same clusters, so those skip the API entirely
+    LABEL_CACHE_SIZE = 256
+    _label_cache: ClassVar["OrderedDict[Tuple[str, ...], Tuple[str, str]]"] = OrderedDict()
+    _label_cache_lock = threading.Lock()
+    
     def __init__(self):
-        self.anthropic_client = Anthropic(api_key=Config.ANTHROPIC_API_KEY)
+        # Shared client: one connection pool per process instead of one per service instance
+        self.anthropic_client = AnthropicService.shared_client()
         self.message_analysis_service = MessageAnalysisService()
         self.auto_k = getattr(Config, "CLUSTERING_AUTO_K", True)
         self.min_k = getattr(Config, "CLUSTERING_MIN_K", 2)
@@ -27,150 +157,233 @@ class ConversationClusteringService:
         self.n_clusters = 5 if self.auto_k else getattr(Config, "CLUSTERING_K", 5)
         self.cluster_centers = None
     
-    def cluster_all_conversations(self) -> bool:
+    def cluster_all_conversations(self, force: bool = False) -> bool:
         """
         Perform clustering on all conversations
         Returns True if clustering was successful, False otherwise
+        
+        Unless force is set, returns True without doing anything when no conversation
+        has changed since the last run started and no message is left unprocessed
+        (the stored clusters are still current).
+        Forced runs come from interactive callers, so they also label clusters with direct
+        calls instead of waiting on a Message Batches request.
         """
         try:
+            started_at = datetime.utcnow()
+            if not force and self._unchanged_since_last_run():
+                logger.info("No conversations changed since the last clustering run, skipping")
+                return True
+            
             logger.info("Starting conversation clustering process")
             
             # Step 1: Analyze all unprocessed messages
             self._analyze_all_messages()
             
             # Step 2: Get conversation data for clustering
-            conversation_data = self._get_conversation_data()
+            batch = self._get_conversation_data()
             
-            if len(conversation_data) < 2:
+            if len(batch) < 2:
                 logger.warning("Not enough conversations to form clusters")
                 return False
             
+            # Cosine is the metric throughout; batch.E is already normalized for the k sweep and the final fit
+            X_norm = batch.E
+            
+            # Previous centroids seed this run when k is unchanged
+            previous_centers = self._previous_centers(X_norm.shape[1])
+            k_swept = False
+            
             if self.auto_k:
-                embeddings = np.array([c['embedding'] for c in conversation_data])
-                selected_k = self._select_optimal_k(embeddings)
-                if not selected_k:
-                    logger.warning("Could not determine a suitable number of clusters")
-                    return False
-                self.n_clusters = selected_k
-                logger.info(f"Auto-selected k={self.n_clusters}")
+                if previous_centers is not None and len(previous_centers) <= len(batch) and self._recent_k_sweep():
+                    self.n_clusters = len(previous_centers)
+                    logger.info(f"Reusing k={self.n_clusters} from the last k sweep")
+                else:
+                    selected_k = self._select_optimal_k(X_norm)
+                    if not selected_k:
+                        logger.warning("Could not determine a suitable number of clusters")
+                        return False
+                    self.n_clusters = selected_k
+                    k_swept = True
+                    logger.info(f"Auto-selected k={self.n_clusters}")
             else:
-                if len(conversation_data) < self.n_clusters:
-                    logger.warning(f"Not enough conversations ({len(conversation_data)}) for {self.n_clusters} clusters")
+                if len(batch) < self.n_clusters:
+                    logger.warning(f"Not enough conversations ({len(batch)}) for {self.n_clusters} clusters")
                     return False
             
+            if previous_centers is not None and len(previous_centers) != self.n_clusters:
+                previous_centers = None
+            
             # Step 3: Perform k-means clustering
-            cluster_assignments = self._perform_clustering(conversation_data)
+            cluster_assignments = self._perform_clustering(X_norm, init=previous_centers)
             
             if cluster_assignments is None:
                 logger.error("Clustering failed")
                 return False
             
             # Step 4: Generate cluster labels and descriptions
-            clusters_info = self._generate_cluster_labels(conversation_data, cluster_assignments)
+            clusters_info = self._generate_cluster_labels(batch, cluster_assignments, use_batch=not force)
             
             # Step 5: Save clusters to database
             self._save_clusters(clusters_info)
             
             # Step 6: Record clustering run
             ClusteringRun.create_run(
-                total_conversations=len(conversation_data),
-                clusters_created=self.n_clusters
+                total_conversations=len(batch),
+                clusters_created=self.n_clusters,
+                k_swept=k_swept,
+                started_at=started_at
             )
             
-            logger.info(f"Successfully clustered {len(conversation_data)} conversations into {self.n_clusters} clusters")
+            logger.info(f"Successfully clustered {len(batch)} conversations into {self.n_clusters} clusters")
             return True
             
         except Exception as e:
             logger.error(f"Error in conversation clustering: {str(e)}")
             return False
     
+    def _unchanged_since_last_run(self) -> bool:
+        """
+        True if the latest run started after the most recent conversation update and no
+        message is waiting for analysis (failed analyses and status resets leave messages
+        unprocessed without touching any conversation, and those still need a run)
+        """
+        if Message.objects(processed_for_clustering=False).only('id').first() is not None:
+            return False
+        last_run = ClusteringRun.objects.order_by('-created_at').only('started_at').first()
+        if not last_run or not last_run.started_at:
+            return False
+        latest = Conversation.objects.order_by('-updated_at').only('updated_at').first()
+        return latest is not None and latest.updated_at <= last_run.started_at
+    
     def _analyze_all_messages(self):
         """Analyze all unprocessed messages for technical concepts and embeddings"""
         try:
-            conversations = Conversation.objects.all()
-            total_analyzed = 0
-            
-            for conversation in conversations:
-                analyzed_count = self.message_analysis_service.analyze_conversation_messages(str(conversation.id))
-                total_analyzed += analyzed_count
+            # Only conversations that still have unprocessed messages need a pass
+            conversation_ids = Message.objects(processed_for_clustering=False).distinct('conversation_id')
+            if not conversation_ids:
+                return
+            
+            # Each pass waits on Claude per message, so conversations are analyzed in parallel
+            workers = min(getattr(Config, 'ANALYSIS_CONCURRENCY', 8), len(conversation_ids))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='clustering-prepass') as executor:
+                total_analyzed = sum(executor.map(
+                    self.message_analysis_service.analyze_conversation_messages,
+                    conversation_ids
+                ))
             
             logger.info(f"Analyzed {total_analyzed} messages across all conversations")
             
         except Exception as e:
             logger.error(f"Error analyzing messages: {str(e)}")
     
-    def _get_conversation_data(self) -> List[Dict]:
+    def _get_conversation_data(self) -> ConversationBatch:
         """
         Get conversation data with embeddings and concepts for clustering
         """
         try:
-            conversations = Conversation.objects.all()
-            conversation_data = []
+            # Stream just the fields used here, keeping (id, title, created_at, updated_at) tuples
+            # rather than a cached list of full documents
+            conversations = [
+                (str(conversation.id), conversation.title, conversation.created_at, conversation.updated_at)
+                for conversation in Conversation.objects.no_cache().batch_size(100).only('id', 'title', 'created_at', 'updated_at')
+            ]
+            
+            # Embeddings (average of message embeddings) and concepts for every conversation
+            # in one pass, cached until a conversation changes
+            features = self.message_analysis_service.get_conversations_features(
+                [(conversation_id, updated_at) for conversation_id, _, _, updated_at in conversations]
+            )
             
+            usable = []
             for conversation in conversations:
-                # Get conversation embedding (average of message embeddings)
-                embedding = self.message_analysis_service.get_conversation_embedding(str(conversation.id))
-                
-                # Get conversation concepts
-                concepts = self.message_analysis_service.get_conversation_concepts(str(conversation.id))
-                
+                embedding, concepts = features[conversation[0]]
                 if embedding and concepts:
-                    conversation_data.append({
-                        'conversation_id': str(conversation.id),
-                        'title': conversation.title,
-                        'embedding': embedding,
-                        'concepts': concepts,
-                        'created_at': conversation.created_at
-                    })
+                    usable.append((conversation, embedding, concepts))
+            
+            # Embeddings are copied row by row into one preallocated float32 matrix
+            dim = len(usable[0][1]) if usable else 0
+            E = np.empty((len(usable), dim), dtype=np.float32)
+            for i, (_, embedding, _) in enumerate(usable):
+                E[i] = embedding
+            
+            batch = ConversationBatch(
+                ids=[conversation[0] for conversation, _, _ in usable],
+                titles=[conversation[1] for conversation, _, _ in usable],
+                E=normalize(E, copy=False) if usable else E,
+                concepts=[concepts for _, _, concepts in usable],
+                created_at=[conversation[2] for conversation, _, _ in usable]
+            )
             
-            logger.info(f"Retrieved data for {len(conversation_data)} conversations")
-            return conversation_data
+            logger.info(f"Retrieved data for {len(batch)} conversations")
+            return batch
             
         except Exception as e:
             logger.error(f"Error getting conversation data: {str(e)}")
-            return []
+            return ConversationBatch([], [], np.empty((0, 0), dtype=np.float32), [], [])
+    
+    def _recent_k_sweep(self) -> bool:
+        """True if a run within CLUSTERING_SWEEP_INTERVAL_HOURS chose k with a full sweep"""
+        interval = timedelta(hours=getattr(Config, "CLUSTERING_SWEEP_INTERVAL_HOURS", 24))
+        return ClusteringRun.objects(k_swept=True, created_at__gte=datetime.utcnow() - interval).only('id').first() is not None
+    
+    def _previous_centers(self, dim: int) -> Optional[np.ndarray]:
+        """Stored cluster centroids in cluster order, or None if there are none usable"""
+        clusters = list(ConversationCluster.objects.only('cluster_id', 'centroid'))
+        if not clusters or any(len(c.centroid) != dim for c in clusters):
+            return None
+        clusters.sort(key=lambda c: int(c.cluster_id.rsplit('_', 1)[1]))
+        return np.array([c.centroid for c in clusters], dtype=np.float32)
     
-    def _perform_clustering(self, conversation_data: List[Dict]) -> Optional[List[int]]:
+    def _perform_clustering(self, X_norm: np.ndarray, init: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
         """
-        Perform k-means clustering on conversation embeddings
+        Perform spherical k-means clustering on L2-normalized conversation embeddings
+        
+        init: previous run's centroids to warm-start from (k-means++ seeding otherwise)
         """
         try:
-            # Extract embeddings
-            embeddings = np.array([conv['embedding'] for conv in conversation_data])
-
-            normalize_for_cosine = getattr(Config, "CLUSTERING_NORMALIZE_EMBEDDINGS", True)
-            if normalize_for_cosine:
-                embeddings = normalize(embeddings)
-
-            # Perform k-means clustering
-            kmeans = KMeans(n_clusters=self.n_clusters, random_state=42, n_init=10)
-            cluster_assignments = kmeans.fit_predict(embeddings)
-            
-            # Store cluster centers for later use
-            self.cluster_centers = kmeans.cluster_centers_
+            cluster_assignments, self.cluster_centers = _spherical_kmeans(X_norm, self.n_clusters, init=init)
             
             logger.info(f"K-means clustering completed with {self.n_clusters} clusters")
-            return cluster_assignments.tolist()
+            return cluster_assignments
             
         except Exception as e:
             logger.error(f"Error performing clustering: {str(e)}")
             return None
     
-    def _generate_cluster_labels(self, conversation_data: List[Dict], cluster_assignments: List[int]) -> List[Dict]:
+    def _generate_cluster_labels(self, batch: ConversationBatch, cluster_assignments: np.ndarray, use_batch: bool = True) -> List[Dict]:
         """
         Generate labels and descriptions for each cluster using Anthropic API
+        use_batch: label through the Message Batches API (background runs only; it can take minutes)
         """
         try:
-            clusters_info = []
+            # Group conversations and find each cluster's top concepts first, so every
+            # cluster can be labeled in one batch
+            members_by_cluster = []
+            top_concepts_by_cluster = []
+            for cluster_id in range(self.n_clusters):
+                # Get conversations (row indices into the batch) in this cluster
+                members = np.flatnonzero(cluster_assignments == cluster_id)
+                
+                # Get top concepts (most frequent) across the cluster's conversations
+                top_concepts = Counter(
+                    concept for i in members for concept in batch.concepts[i]
+                ).most_common(10)
+                members_by_cluster.append(members)
+                top_concepts_by_cluster.append([concept for concept, count in top_concepts])
+            
+            # Generate cluster labels and descriptions using Anthropic
+            labels = self._generate_cluster_labels_with_ai({
+                cluster_id: top_concepts_by_cluster[cluster_id]
+                for cluster_id in range(self.n_clusters)
+                if len(members_by_cluster[cluster_id])
+            }, use_batch=use_batch)
             
+            clusters_info = []
+            centers_lists = self.cluster_centers.tolist()
             for cluster_id in range(self.n_clusters):
-                # Get conversations in this cluster
-                cluster_conversations = [
-                    conversation_data[i] for i, assignment in enumerate(cluster_assignments)
-                    if assignment == cluster_id
-                ]
+                members = members_by_cluster[cluster_id]
                 
-                if not cluster_conversations:
+                if not len(members):
                     # Empty cluster - create default
                     clusters_info.append({
                         'cluster_id': f"cluster_{cluster_id}",
@@ -178,33 +391,18 @@ class ConversationClusteringService:
                         'description': "Various technical discussions and problem-solving conversations.",
                         'conversation_ids': [],
                         'key_concepts': [],
-                        'centroid': self.cluster_centers[cluster_id].tolist()
+                        'centroid': centers_lists[cluster_id]
                     })
                     continue
                 
-                # Collect all concepts from conversations in this cluster
-                all_concepts = []
-                for conv in cluster_conversations:
-                    all_concepts.extend(conv['concepts'])
-                
-                # Get top concepts (most frequent)
-                concept_counts = {}
-                for concept in all_concepts:
-                    concept_counts[concept] = concept_counts.get(concept, 0) + 1
-                
-                top_concepts = sorted(concept_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-                top_concept_names = [concept for concept, count in top_concepts]
-                
-                # Generate cluster label and description using Anthropic
-                label, description = self._generate_cluster_label_with_ai(top_concept_names)
-                
+                label, description = labels[cluster_id]
                 clusters_info.append({
                     'cluster_id': f"cluster_{cluster_id}",
                     'label': label,
                     'description': description,
-                    'conversation_ids': [conv['conversation_id'] for conv in cluster_conversations],
-                    'key_concepts': top_concept_names,
-                    'centroid': self.cluster_centers[cluster_id].tolist()
+                    'conversation_ids': [batch.ids[i] for i in members],
+                    'key_concepts': top_concepts_by_cluster[cluster_id],
+                    'centroid': centers_lists[cluster_id]
                 })
                 
                 logger.info(f"Generated label for cluster {cluster_id}: {label}")
@@ -215,14 +413,96 @@ class ConversationClusteringService:
             logger.error(f"Error generating cluster labels: {str(e)}")
             return []
     
-    def _generate_cluster_label_with_ai(self, top_concepts: List[str]) -> Tuple[str, str]:
+    def _generate_cluster_labels_with_ai(
+        self,
+        top_concepts_by_cluster: Dict[int, List[str]],
+        use_batch: bool = True
+    ) -> Dict[int, Tuple[str, str]]:
         """
-        Generate cluster label and description using Anthropic API
+        Label every cluster through one Message Batches request (or, without use_batch, one
+        direct call per cluster)
+        
+        Clusters whose batch entry errored, or all of them if the batch fails or does not
+        finish within LABEL_BATCH_TIMEOUT_SECS, are labeled with one direct call each.
         """
-        try:
-            concepts_text = ", ".join(top_concepts[:8])  # Use top 8 concepts
-            
-            prompt = f"""You are analyzing clusters of professional conversations where people use AI for work assistance.
+        labels = {}
+        pending = {}
+        for cluster_id, top_concepts in top_concepts_by_cluster.items():
+            cached = self._cached_label(top_concepts)
+            if cached:
+                labels[cluster_id] = cached
+            else:
+                pending[cluster_id] = top_concepts
+        
+        if pending and use_batch:
+            try:
+                labels.update(self._run_label_batch(pending))
+            except Exception as e:
+                logger.warning(f"Cluster label batch failed, labeling clusters one by one: {str(e)}")
+        
+        for cluster_id, top_concepts in top_concepts_by_cluster.items():
+            if cluster_id not in labels:
+                labels[cluster_id] = self._generate_cluster_label_with_ai(top_concepts)
+        return labels
+    
+    def _run_label_batch(self, top_concepts_by_cluster: Dict[int, List[str]]) -> Dict[int, Tuple[str, str]]:
+        """Submit one labeling request per cluster as a batch and collect the succeeded results"""
+        batches = self.anthropic_client.beta.messages.batches
+        batch = batches.create(requests=[
+            {
+                'custom_id': f"cluster_{cluster_id}",
+                'params': self._cluster_label_params(top_concepts)
+            }
+            for cluster_id, top_concepts in top_concepts_by_cluster.items()
+        ])
+        
+        deadline = time.monotonic() + self.LABEL_BATCH_TIMEOUT_SECS
+        while batch.processing_status != 'ended':
+            if time.monotonic() > deadline:
+                batches.cancel(batch.id)
+                raise TimeoutError(f"batch {batch.id} still {batch.processing_status}")
+            time.sleep(self.LABEL_BATCH_POLL_SECS)
+            batch = batches.retrieve(batch.id)
+        
+        # A bad entry only costs its own cluster: it is left out, so the caller labels it directly
+        labels = {}
+        for entry in batches.results(batch.id):
+            try:
+                cluster_id = int(entry.custom_id.rsplit('_', 1)[1])
+                if entry.result.type == 'succeeded':
+                    response_text = entry.result.message.content[0].text.strip()
+                    labels[cluster_id] = self._parse_cluster_label(response_text, top_concepts_by_cluster[cluster_id])
+                else:
+                    logger.warning(f"Cluster label batch entry {entry.custom_id} {entry.result.type}")
+            except Exception as e:
+                logger.warning(f"Could not read cluster label batch entry {entry.custom_id}: {str(e)}")
+        return labels
+    
+    @staticmethod
+    def _label_cache_key(top_concepts: List[str]) -> Tuple[str, ...]:
+        return tuple(sorted(top_concepts[:8]))
+    
+    def _cached_label(self, top_concepts: List[str]) -> Optional[Tuple[str, str]]:
+        """Previously generated AI label for the same top concepts, if any"""
+        key = self._label_cache_key(top_concepts)
+        with self._label_cache_lock:
+            label = self._label_cache.get(key)
+            if label:
+                self._label_cache.move_to_end(key)
+            return label
+    
+    def _remember_label(self, top_concepts: List[str], label: Tuple[str, str]):
+        """Store an AI label (fallback labels are never cached, so they get retried)"""
+        with self._label_cache_lock:
+            self._label_cache[self._label_cache_key(top_concepts)] = label
+            while len(self._label_cache) > self.LABEL_CACHE_SIZE:
+                self._label_cache.popitem(last=False)
+    
+    def _cluster_label_params(self, top_concepts: List[str]) -> Dict:
+        """Messages API parameters for labeling one cluster"""
+        concepts_text = ", ".join(top_concepts[:8])  # Use top 8 concepts
+        
+        prompt = f"""You are analyzing clusters of professional conversations where people use AI for work assistance.
 
 Here are the top technical concepts from a cluster:
 {concepts_text}
@@ -232,44 +512,64 @@ Create a study guide title and description:
 - Description: 2 sentences explaining what professionals would learn from this cluster
 
 Format as JSON: {{"title": "...", "description": "..."}}"""
-            
-            response = self.anthropic_client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=300,
-                temperature=0.1,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            )
+        
+        return {
+            'model': "claude-3-5-sonnet-20241022",
+            'max_tokens': 300,
+            'temperature': 0.1,
+            'messages': [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        }
+    
+    def _generate_cluster_label_with_ai(self, top_concepts: List[str]) -> Tuple[str, str]:
+        """
+        Generate cluster label and description using Anthropic API
+        """
+        cached = self._cached_label(top_concepts)
+        if cached:
+            return cached
+        
+        try:
+            response = self.anthropic_client.messages.create(**self._cluster_label_params(top_concepts))
             
             response_text = response.content[0].text.strip()
-            
-            # Try to extract JSON from the response
-            try:
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}') + 1
+            return self._parse_cluster_label(response_text, top_concepts)
                 
-                if start_idx != -1 and end_idx != 0:
-                    json_str = response_text[start_idx:end_idx]
-                    result = json.loads(json_str)
-                    
-                    title = result.get('title', 'Technical Concepts').strip()
-                    description = result.get('description', 'Professional technical discussions and problem-solving.').strip()
-                    
-                    return title, description
-                else:
-                    logger.warning(f"No JSON found in cluster labeling response: {response_text}")
+        except Exception as e:
+            logger.error(f"Error generating cluster label with AI: {str(e)}")
+            return self._generate_fallback_label(top_concepts)
+    
+    def _parse_cluster_label(self, response_text: str, top_concepts: List[str]) -> Tuple[str, str]:
+        """Extract (title, description) from a labeling response, falling back to a concept-based label"""
+        # Try to extract JSON from the response
+        try:
+            match = _JSON_OBJECT_RE.search(response_text)
+            
+            if match:
+                result = orjson.loads(match.group(0))
+                if not isinstance(result, dict):
+                    logger.warning(f"Unexpected cluster labeling response: {response_text}")
                     return self._generate_fallback_label(top_concepts)
-                    
-            except json.JSONDecodeError as e:
-                logger.warning(f"Failed to parse JSON from cluster labeling: {response_text}, error: {e}")
+                
+                # Missing, null or non-string values fall back to the defaults
+                title = result.get('title')
+                description = result.get('description')
+                title = title.strip() if isinstance(title, str) and title.strip() else 'Technical Concepts'
+                description = description.strip() if isinstance(description, str) and description.strip() \
+                    else 'Professional technical discussions and problem-solving.'
+                
+                self._remember_label(top_concepts, (title, description))
+                return title, description
+            else:
+                logger.warning(f"No JSON found in cluster labeling response: {response_text}")
                 return self._generate_fallback_label(top_concepts)
                 
-        except Exception as e:
-            logger.error(f"Error generating cluster label with AI: {str(e)}")
+        except json.JSONDecodeError as e:
+            logger.warning(f"Failed to parse JSON from cluster labeling: {response_text}, error: {e}")
             return self._generate_fallback_label(top_concepts)
     
     def _generate_fallback_label(self, top_concepts: List[str]) -> Tuple[str, str]:
@@ -287,12 +587,8 @@ Format as JSON: {{"title": "...", "description": "..."}}"""
     def _save_clusters(self, clusters_info: List[Dict]):
         """Save cluster information to database"""
         try:
-            # Clear existing clusters
-            ConversationCluster.objects.delete()
-            
-            # Save new clusters
-            for cluster_info in clusters_info:
-                cluster = ConversationCluster(
+            clusters = [
+                ConversationCluster(
                     cluster_id=cluster_info['cluster_id'],
                     label=cluster_info['label'],
                     description=cluster_info['description'],
@@ -300,8 +596,18 @@ Format as JSON: {{"title": "...", "description": "..."}}"""
                     key_concepts=cluster_info['key_concepts'],
                     centroid=cluster_info['centroid']
                 )
-                cluster.save()
-                
+                for cluster_info in clusters_info
+            ]
+            # insert() skips save(), so validate up front and keep the old clusters if anything is invalid
+            for cluster in clusters:
+                cluster.validate()
+            
+            # Replace existing clusters: one delete and one insert_many
+            ConversationCluster.objects.delete()
+            if clusters:
+                ConversationCluster.objects.insert(clusters, load_bulk=False)
+            
+            for cluster_info in clusters_info:
                 logger.info(f"Saved cluster {cluster_info['cluster_id']}: {cluster_info['label']}")
             
         except Exception as e:
@@ -350,38 +656,37 @@ Format as JSON: {{"title": "...", "description": "..."}}"""
                 return []
             
             # Get all conversation data
-            conversation_data = self._get_conversation_data()
-            
-            # Calculate similarities
-            target_embedding = np.array(target_embedding).reshape(1, -1)
-            similarities = []
-            
-            for conv_data in conversation_data:
-                if conv_data['conversation_id'] == conversation_id:
-                    continue  # Skip the target conversation itself
-                
-                conv_embedding = np.array(conv_data['embedding']).reshape(1, -1)
-                similarity = cosine_similarity(target_embedding, conv_embedding)[0][0]
-                
-                if similarity >= threshold:
-                    similarities.append({
-                        'conversation_id': conv_data['conversation_id'],
-                        'title': conv_data['title'],
-                        'similarity': float(similarity),
-                        'concepts': conv_data['concepts']
-                    })
-            
-            # Sort by similarity (highest first)
-            similarities.sort(key=lambda x: x['similarity'], reverse=True)
+            batch = self._get_conversation_data()
+            others = np.array([conv_id != conversation_id for conv_id in batch.ids], dtype=bool)
+            if not others.any():
+                return []
             
-            return similarities[:10]  # Return top 10 similar conversations
+            # Cosine similarity against every conversation in one matrix-vector product
+            target = normalize(np.asarray(target_embedding, dtype=np.float32).reshape(1, -1))[0]
+            sims = batch.E @ target
+            
+            # Top 10 at or above the threshold, highest first (the target itself excluded)
+            candidates = np.flatnonzero(others & (sims >= threshold))
+            if len(candidates) > 10:
+                candidates = candidates[np.argpartition(-sims[candidates], 10)[:10]]
+            candidates = candidates[np.argsort(-sims[candidates])]
+            
+            return [
+                {
+                    'conversation_id': batch.ids[i],
+                    'title': batch.titles[i],
+                    'similarity': float(sims[i]),
+                    'concepts': batch.concepts[i]
+                }
+                for i in candidates
+            ]
             
         except Exception as e:
             logger.error(f"Error finding similar conversations: {str(e)}")
             return []
 
-    def _select_optimal_k(self, embeddings: np.ndarray) -> Optional[int]:
-        n = embeddings.shape[0]
+    def _select_optimal_k(self, X_norm: np.ndarray) -> Optional[int]:
+        n = X_norm.shape[0]
         if n < 2:
             return None
         k_min = max(2, min(self.min_k, n))
@@ -391,21 +696,33 @@ Format as JSON: {{"title": "...", "description": "..."}}"""
 
         # Configurable knobs
         prefer_delta = 0.01  # favor larger k within this margin
+        patience = 3  # stop after this many consecutive k that could not be selected
+        poor_structure = 0.05  # stop once a k past the best scores below this silhouette
 
-        X = embeddings
-        X = normalize(X)
+        X = X_norm
 
         best_k, best_sil = None, -1.0
         best_ch = -np.inf
+        misses = 0
+
+        # Each k after the first starts from the previous k's centroids with its worst cluster split
+        prev_labels, prev_centers = None, None
 
         for k in range(k_min, k_max + 1):
             try:
-                km = KMeans(n_clusters=k, random_state=42, n_init=10)
-                labels = km.fit_predict(X)
+                init = _split_worst_cluster(X, prev_labels, prev_centers) if prev_centers is not None else None
+                labels, centers = _spherical_kmeans(X, k, init=init)
+                if init is not None and len(np.unique(labels)) < k:
+                    # The split collapsed; retry from k-means++ seeding
+                    labels, centers = _spherical_kmeans(X, k)
+                prev_labels, prev_centers = labels, centers
                 if len(set(labels)) < 2:
                     continue
 
-                sil = silhouette_score(X, labels, metric="cosine")
+                sil = silhouette_score(
+                    X, labels, metric="cosine",
+                    sample_size=min(self.SILHOUETTE_SAMPLE_SIZE, n), random_state=42
+                )
                 ch = calinski_harabasz_score(X, labels)
 
                 # Update if significantly better
@@ -418,6 +735,13 @@ Format as JSON: {{"title": "...", "description": "..."}}"""
                             best_k, best_sil, best_ch = k, sil, ch
                         elif abs(sil - best_sil) <= 1e-6 and ch > best_ch:
                             best_k, best_sil, best_ch = k, sil, ch
+
+                # Silhouette over k is close to unimodal in practice: once it has fallen out of
+                # reach of the best for a few k in a row, or collapsed, larger k will not win
+                misses = 0 if best_k == k else misses + 1
+                if misses >= patience or (best_k != k and sil < poor_structure):
+                    logger.info(f"Stopping k sweep at k={k} (best k={best_k}, silhouette {best_sil:.3f})")
+                    break
             except Exception as e:
                 logger.warning(f"Silhouette eval failed for k={k}: {e}")
         return best_k
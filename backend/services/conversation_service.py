@@ -1,6 +1,10 @@
-from typing import List, Optional, Dict, Any
+import base64
+import json
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import ClassVar, List, Optional, Dict, Any, Tuple
+from bson import ObjectId
 from models.conversation import Conversation
-from models.message import Message
 from services.anthropic_service import AnthropicService
 from services.message_analysis_service import MessageAnalysisService
 from services.conversation_clustering_service import ConversationClusteringService
@@ -12,6 +16,12 @@ logger = logging.getLogger(__name__)
 class ConversationService:
     """Service for managing conversations and Claude interactions"""
     
+    # Background title updates; a small pool is enough since each one is a single short call
+    _title_executor: ClassVar[ThreadPoolExecutor] = ThreadPoolExecutor(
+        max_workers=2,
+        thread_name_prefix='conversation-title'
+    )
+    
     def __init__(self):
         self.anthropic_service = AnthropicService()
         self.message_analysis_service = MessageAnalysisService()
@@ -51,18 +61,53 @@ class ConversationService:
         return conversation
     
     @staticmethod
-    def get_all_conversations(limit: int = 50, offset: int = 0) -> List[Conversation]:
+    def get_all_conversations(limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Conversation], Optional[str]]:
         """
-        Get all conversations
+        Get conversations, most recently updated first, one page at a time
+        
+        Pages are keyset-based: each page starts strictly after the (updated_at, id) of
+        the previous page's last conversation, so deep pages cost the same as the first.
         
         Args:
             limit: Maximum number of conversations to return
-            offset: Number of conversations to skip
+            cursor: Opaque cursor returned with the previous page (None for the first page)
             
         Returns:
-            List of all conversations
+            Tuple of (conversations, next_cursor); next_cursor is None on the last page
         """
-        return Conversation.objects().order_by('-updated_at').skip(offset).limit(limit)
+        query = Conversation.objects()
+        if cursor:
+            updated_at, last_id = ConversationService._decode_cursor(cursor)
+            query = Conversation.objects(__raw__={'$or': [
+                {'updated_at': {'$lt': updated_at}},
+                {'updated_at': updated_at, '_id': {'$lt': last_id}}
+            ]})
+        
+        conversations = list(query.order_by('-updated_at', '-id').limit(limit))
+        
+        next_cursor = None
+        if len(conversations) == limit:
+            next_cursor = ConversationService._encode_cursor(conversations[-1])
+        
+        return conversations, next_cursor
+    
+    @staticmethod
+    def _encode_cursor(conversation: Conversation) -> str:
+        """Encode a conversation's sort key as a URL-safe pagination cursor"""
+        payload = json.dumps({
+            'updated_at': conversation.updated_at.isoformat(),
+            'id': str(conversation.id)
+        })
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+    
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+        """Decode a pagination cursor; raises ValueError if it is malformed"""
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            return datetime.fromisoformat(payload['updated_at']), ObjectId(payload['id'])
+        except Exception as e:
+            raise ValueError(f"Invalid cursor: {cursor}") from e
     
     @staticmethod
     def get_conversation_by_id(conversation_id: str) -> Optional[Conversation]:
@@ -114,37 +159,39 @@ class ConversationService:
         Yields:
             Dict with streaming response data
         """
+        # Every payload carries the id; convert it once rather than per chunk
+        conversation_id = str(conversation.id)
         try:
             # Get conversation history for Anthropic
             message_history = conversation.get_message_history()
             
-            # Stream response from Anthropic
-            accumulated_content = ""
+            # Stream response from Anthropic; pieces are joined once when the reply is complete
+            content_parts = []
             
             for chunk in self.anthropic_service.stream_conversation_response(message_history):
-                if chunk.get('content'):
-                    accumulated_content += chunk['content']
+                if chunk.content:
+                    content_parts.append(chunk.content)
                 
                 yield {
-                    'content': chunk.get('content', ''),
-                    'is_complete': chunk.get('is_complete', False),
-                    'error': chunk.get('error'),
-                    'conversation_id': str(conversation.id)
+                    'content': chunk.content,
+                    'is_complete': chunk.is_complete,
+                    'error': chunk.error,
+                    'conversation_id': conversation_id
                 }
                 
                 # If response is complete, save the assistant message
-                if chunk.get('is_complete') and not chunk.get('error'):
-                    message_id = conversation.add_message('assistant', accumulated_content)
+                if chunk.is_complete and not chunk.error:
+                    message_id = conversation.add_message('assistant', "".join(content_parts))
                     
                     # Trigger real-time analysis and clustering
-                    self._trigger_conversation_analysis(conversation)
+                    self._trigger_conversation_analysis(conversation_id, message_id)
                     
                     yield {
                         'content': '',
                         'message_id': message_id,
                         'is_complete': True,
                         'error': None,
-                        'conversation_id': str(conversation.id)
+                        'conversation_id': conversation_id
                     }
                     break
                     
@@ -153,7 +200,7 @@ class ConversationService:
                 'content': '',
                 'is_complete': True,
                 'error': str(e),
-                'conversation_id': str(conversation.id)
+                'conversation_id': conversation_id
             }
     
     @staticmethod
@@ -181,6 +228,18 @@ class ConversationService:
                 # Silently fail title updates to not disrupt conversation flow
                 print(f"Failed to update conversation title: {e}")
     
+    @staticmethod
+    def update_conversation_title_async(conversation: Conversation, anthropic_service: AnthropicService = None):
+        """
+        Queue update_conversation_title on a background thread
+        
+        The title call is a separate Claude round-trip; running it off the request thread
+        lets the SSE stream close as soon as the assistant message is saved.
+        """
+        ConversationService._title_executor.submit(
+            ConversationService.update_conversation_title, conversation, anthropic_service
+        )
+    
     @staticmethod
     def _generate_title_from_message(message: str) -> str:
         """
@@ -199,27 +258,19 @@ class ConversationService:
         
         return title if title else "New Conversation"
     
-    def _trigger_conversation_analysis(self, conversation: Conversation):
+    def _trigger_conversation_analysis(self, conversation_id: str, message_id: str):
         """
-        Trigger background analysis and clustering for a conversation
+        Trigger background analysis and clustering for a newly saved message
         
         Args:
-            conversation: Conversation to analyze
+            conversation_id: ID of the conversation the message belongs to
+            message_id: ID of the message to analyze
         """
         try:
-            # Get the latest message from the conversation to trigger background analysis
-            messages = Message.get_conversation_messages(str(conversation.id))
-            if messages:
-                latest_message = messages.order_by('-created_at').first()
-                if latest_message:
-                    # Trigger background analysis and clustering
-                    background_service = BackgroundClusteringService()
-                    background_service.trigger_background_analysis(latest_message.message_id)
-                    logger.info(f"Triggered background analysis for message {latest_message.message_id} in conversation {conversation.id}")
-                else:
-                    logger.warning(f"No messages found in conversation {conversation.id}")
-            else:
-                logger.warning(f"Could not retrieve messages for conversation {conversation.id}")
+            # Trigger background analysis and clustering
+            background_service = BackgroundClusteringService()
+            background_service.trigger_background_analysis(message_id)
+            logger.info(f"Triggered background analysis for message {message_id} in conversation {conversation_id}")
             
         except Exception as e:
             # Don't let analysis errors disrupt the conversation flow
@@ -1,17 +1,87 @@
-import json
+import hashlib
 import logging
-from typing import List, Optional
-from anthropic import Anthropic
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import ClassVar, Dict, List, Optional, Tuple
+import numpy as np
+from services.anthropic_service import AnthropicService
+from pymongo import UpdateOne
 from models.message import Message
+from models.concept_cache import ConceptCache
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Concept extraction is a forced call to this tool, so the reply is structured input rather than text
+_CONCEPTS_TOOL = {
+    "name": "record_concepts",
+    "description": "Record the key concepts discussed in a message",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "concepts": {
+                "type": "array",
+                "maxItems": 3,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "title": {"type": "string", "description": "short title (2–6 words)"},
+                        "summary": {"type": "string", "description": "one-sentence summary of the concept"}
+                    },
+                    "required": ["title", "summary"]
+                }
+            }
+        },
+        "required": ["concepts"]
+    }
+}
+
+EMBEDDING_DIM = 1024
+
+def pack_embedding(embedding: List[float]) -> bytes:
+    """Pack an embedding into the float32 bytes stored in Message.embedding"""
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+def unpack_embedding(value) -> Optional[np.ndarray]:
+    """
+    Read a stored Message.embedding as a float32 vector, or None if it is missing or the wrong size
+    Messages analyzed before embeddings were packed still hold a list of floats, so both are accepted.
+    """
+    if not value:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        if len(value) != EMBEDDING_DIM * 4:
+            return None
+        return np.frombuffer(value, dtype=np.float32)
+    if len(value) != EMBEDDING_DIM:
+        return None
+    return np.asarray(value, dtype=np.float32)
+
 class MessageAnalysisService:
     """Service for analyzing messages to extract technical concepts and generate embeddings"""
     
+    # conversation_id -> (conversation updated_at, embedding, concepts). Class-level so every
+    # service instance shares it; an entry is dropped whenever one of its messages is analyzed.
+    _features_cache: ClassVar[Dict[str, Tuple[datetime, Optional[List[float]], List[str]]]] = {}
+    _features_lock = threading.Lock()
+    
+    # sha256(content) -> extracted concepts, in front of the concept_cache collection
+    CONCEPT_CACHE_SIZE = 1024
+    _concept_cache: ClassVar["OrderedDict[str, List[dict]]"] = OrderedDict()
+    _concept_cache_lock = threading.Lock()
+    
+    # Concept extraction calls are I/O-bound; one shared pool bounds the number of concurrent
+    # Anthropic requests across every conversation being analyzed
+    _extraction_executor: ClassVar[ThreadPoolExecutor] = ThreadPoolExecutor(
+        max_workers=getattr(Config, 'EXTRACTION_WORKERS', 8),
+        thread_name_prefix='concept-extraction'
+    )
+    
     def __init__(self):
-        self.anthropic_client = Anthropic(api_key=Config.ANTHROPIC_API_KEY)
+        # Shared client: one connection pool per process instead of one per service instance
+        self.anthropic_client = AnthropicService.shared_client()
     
     def analyze_message(self, message: Message) -> bool:
         """
@@ -24,36 +94,117 @@ class MessageAnalysisService:
                 logger.info(f"Message {message.message_id} already processed for clustering")
                 return True
             
-            # Extract technical concepts
-            concepts = self.extract_technical_concepts(message.content)
-            if not concepts:
-                logger.warning(f"No technical concepts extracted from message {message.message_id}. Concepts is {concepts}")
-                concepts = []
-            # concepts is a list of dicts with 'title' and 'summary' fields.
-            # Combine them into a single string per concept: "Title: Summary"
-            concepts_str = ", ".join(f"{c.get('title', '')}: {c.get('summary', '')}" for c in concepts)
-            # Generate embedding
-            embedding = self.generate_embedding(concepts_str)
-            if not embedding:
-                logger.error(f"Failed to generate embedding for message {message.message_id}")
+            analysis = self._compute_analysis(message)
+            if analysis is None:
                 return False
             
             # Update message with analysis results
-            message.technical_concepts = [c.get('title') for c in concepts]
-            message.embedding = embedding
+            message.technical_concepts = analysis['technical_concepts']
+            message.embedding = analysis['embedding']
             message.processed_for_clustering = True
             message.save()
+            self.invalidate_conversation_features(message.conversation_id)
             
-            logger.info(f"Successfully analyzed message {message.message_id} - found {len(concepts)} concepts")
+            logger.info(f"Successfully analyzed message {message.message_id} - found {len(analysis['technical_concepts'])} concepts")
             return True
             
         except Exception as e:
             logger.error(f"Error analyzing message {message.message_id}: {str(e)}")
             return False
     
-    def extract_technical_concepts(self, content: str) -> List[str]:
+    def _compute_analysis(self, message: Message) -> Optional[dict]:
+        """
+        Extract concepts and the embedding for a message without saving anything
+        Returns the fields to $set on the message, or None if no embedding could be generated
+        """
+        concepts = self._message_concepts(message.message_id, message.content)
+        embedding = self.generate_embedding(self._concepts_text(concepts))
+        return self._analysis_fields(message.message_id, concepts, embedding)
+    
+    def _message_concepts(self, message_id: str, content: str) -> List[dict]:
+        """Extract the technical concepts of a message (empty list if none)"""
+        concepts = self.extract_technical_concepts(content)
+        if not concepts:
+            logger.warning(f"No technical concepts extracted from message {message_id}. Concepts is {concepts}")
+            concepts = []
+        return concepts
+    
+    def _try_message_concepts(self, message_doc: dict) -> Optional[List[dict]]:
+        """_message_concepts for a raw message document; logs and returns None instead of raising"""
+        try:
+            return self._message_concepts(message_doc['message_id'], message_doc['content'])
+        except Exception as e:
+            logger.error(f"Error analyzing message {message_doc.get('message_id')}: {str(e)}")
+            return None
+    
+    @staticmethod
+    def _concepts_text(concepts: List[dict]) -> str:
+        """Text that gets embedded for a message's concepts"""
+        # concepts is a list of dicts with 'title' and 'summary' fields.
+        # Combine them into a single string per concept: "Title: Summary"
+        return ", ".join(f"{c.get('title', '')}: {c.get('summary', '')}" for c in concepts)
+    
+    @staticmethod
+    def _analysis_fields(message_id: str, concepts: List[dict], embedding: Optional[List[float]]) -> Optional[dict]:
+        """Message fields to $set for an analysis, or None if the embedding is missing"""
+        if not embedding:
+            logger.error(f"Failed to generate embedding for message {message_id}")
+            return None
+        
+        return {
+            'technical_concepts': [c.get('title') for c in concepts],
+            'embedding': pack_embedding(embedding),
+            'processed_for_clustering': True
+        }
+    
+    def extract_technical_concepts(self, content: str) -> List[dict]:
         """
         Extract technical concepts from message content using Anthropic API
+        Results are cached by content hash, in process and in the concept_cache collection,
+        so identical content is only sent to Claude once
+        """
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        
+        concepts = self._cached_concepts(content_hash)
+        if concepts is not None:
+            return concepts
+        
+        try:
+            concepts = ConceptCache.get_concepts(content_hash)
+        except Exception as e:
+            logger.error(f"Error reading concept cache: {str(e)}")
+        if concepts is None:
+            concepts = self._request_technical_concepts(content)
+            if concepts is None:
+                # Failed extractions are not cached, so they get retried
+                return []
+            try:
+                ConceptCache.store_concepts(content_hash, concepts)
+            except Exception as e:
+                logger.error(f"Error writing concept cache: {str(e)}")
+        
+        self._remember_concepts(content_hash, concepts)
+        return concepts
+    
+    def _cached_concepts(self, content_hash: str) -> Optional[List[dict]]:
+        """Concepts extracted in this process for the same content hash, if any"""
+        with self._concept_cache_lock:
+            concepts = self._concept_cache.get(content_hash)
+            if concepts is not None:
+                self._concept_cache.move_to_end(content_hash)
+            return concepts
+    
+    def _remember_concepts(self, content_hash: str, concepts: List[dict]):
+        """Store extracted concepts in the in-process LRU"""
+        with self._concept_cache_lock:
+            self._concept_cache[content_hash] = concepts
+            while len(self._concept_cache) > self.CONCEPT_CACHE_SIZE:
+                self._concept_cache.popitem(last=False)
+    
+    def _request_technical_concepts(self, content: str) -> Optional[List[dict]]:
+        """
+        Ask Claude for the concepts in a message
+        Returns None (rather than an empty list) when the request or parsing failed
         """
         try:
             prompt = f"""You are an assistant that extracts 0–3 key concepts from a single message in a conversation.
@@ -67,26 +218,15 @@ Guidelines:
 - Prefer combining closely related details into one clear concept.
 - If no meaningful concept is present, return an empty list.
 
-Output:
-- Return JSON only. No extra text, no code fences, no markdown.
-- Use exactly this schema and field names:
-
-{{
-  "concepts": [
-    {{
-      "title": "short title (2–6 words)",
-      "summary": "one-sentence summary of the concept"
-    }}
-  ]
-}}
-
-If none, return: {{"concepts": []}}
+Report the concepts with the record_concepts tool.
 
 Message: {content}"""
             response = self.anthropic_client.messages.create(
                 model="claude-3-5-sonnet-20241022",
-                max_tokens=200,
+                max_tokens=300,
                 temperature=0.1,
+                tools=[_CONCEPTS_TOOL],
+                tool_choice={"type": "tool", "name": _CONCEPTS_TOOL["name"]},
                 messages=[
                     {
                         "role": "user",
@@ -95,30 +235,19 @@ Message: {content}"""
                 ]
             )
             
-            # Parse the JSON response
-            response_text = response.content[0].text.strip()
-            # Try to extract JSON from the response
-            try:
-                # Look for JSON in the response
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}') + 1
-                
-                if start_idx != -1 and end_idx != 0:
-                    json_str = response_text[start_idx:end_idx]
-                    result = json.loads(json_str)
-                    concepts = result.get('concepts', [])
-                    return concepts
-                else:
-                    logger.warning(f"No JSON found in concept extraction response: {response_text}")
-                    return []
-                    
-            except json.JSONDecodeError as e:
-                logger.warning(f"Failed to parse JSON from concept extraction: {response_text}, error: {e}")
-                return []
+            # The forced tool call carries the concepts as already-parsed input
+            if response.stop_reason == "max_tokens":
+                logger.warning("Concept extraction response was truncated")
+                return None
+            tool_input = next((block.input for block in response.content if block.type == "tool_use"), None)
+            if not isinstance(tool_input, dict) or not isinstance(tool_input.get('concepts'), list):
+                logger.warning(f"Unexpected concept extraction response: {response.content}")
+                return None
+            return tool_input['concepts']
                 
         except Exception as e:
             logger.error(f"Error extracting technical concepts: {str(e)}")
-            return []
+            return None
     
     def generate_embedding(self, content: str) -> Optional[List[float]]:
         """
@@ -130,51 +259,58 @@ Message: {content}"""
             # For prototype: create a simple embedding based on content
             # In production, you'd use a proper embedding model like OpenAI's text-embedding-ada-002
             
-            # Simple approach: use content characteristics to create a basic embedding
-            import hashlib
-            import struct
-            
-            # Create a hash of the content
-            content_hash = hashlib.md5(content.encode()).hexdigest()
+            # Simple approach: seed a generator with a short blake2b digest of the content,
+            # so identical content always maps to the same vector
+            seed = int.from_bytes(hashlib.blake2b(content.encode(), digest_size=8).digest(), 'little')
+            embedding = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM, dtype=np.float32).tolist()
             
-            # Convert hash to a list of floats (1024 dimensions for consistency)
-            embedding = []
-            for i in range(0, len(content_hash), 2):
-                # Convert hex pairs to integers, then normalize to [-1, 1]
-                hex_pair = content_hash[i:i+2]
-                int_val = int(hex_pair, 16)
-                normalized_val = (int_val - 127.5) / 127.5  # Normalize to [-1, 1]
-                embedding.append(normalized_val)
-            
-            # Pad or truncate to 1024 dimensions
-            while len(embedding) < 1024:
-                embedding.extend(embedding[:min(len(embedding), 1024 - len(embedding))])
-            
-            embedding = embedding[:1024]
-            
-            logger.info(f"Generated {len(embedding)}-dimensional embedding")
+            logger.debug("Generated %d-dimensional embedding", len(embedding))
             return embedding
             
         except Exception as e:
             logger.error(f"Error generating embedding: {str(e)}")
             return None
     
+    def generate_embeddings_batch(self, contents: List[str]) -> List[Optional[List[float]]]:
+        """
+        Generate embeddings for many contents at once, in input order
+        Callers that have several texts go through here so a batched embedding provider
+        can serve them with one request; the prototype hash embedding is computed per text
+        """
+        return [self.generate_embedding(content) for content in contents]
+    
     def analyze_conversation_messages(self, conversation_id: str) -> int:
         """
         Analyze all unprocessed messages in a conversation
         Returns the number of messages successfully analyzed
         """
         try:
-            # Get all unprocessed messages for this conversation
-            unprocessed_messages = Message.objects(
-                conversation_id=conversation_id,
-                processed_for_clustering=False
-            )
+            # Get all unprocessed messages for this conversation as raw documents: only three
+            # fields are read, so building Message objects would be pure overhead
+            collection = Message._get_collection()
+            message_docs = list(collection.find(
+                {'conversation_id': conversation_id, 'processed_for_clustering': False},
+                projection={'_id': 1, 'message_id': 1, 'content': 1}
+            ))
             
-            analyzed_count = 0
-            for message in unprocessed_messages:
-                if self.analyze_message(message):
-                    analyzed_count += 1
+            # Extract concepts in parallel, embed them in one batch, then write all results in one round-trip
+            extracted = [
+                (message_doc, concepts)
+                for message_doc, concepts in zip(message_docs, self._extraction_executor.map(self._try_message_concepts, message_docs))
+                if concepts is not None
+            ]
+            embeddings = self.generate_embeddings_batch([self._concepts_text(concepts) for _, concepts in extracted])
+            
+            updates = []
+            for (message_doc, concepts), embedding in zip(extracted, embeddings):
+                analysis = self._analysis_fields(message_doc['message_id'], concepts, embedding)
+                if analysis is not None:
+                    updates.append(UpdateOne({'_id': message_doc['_id']}, {'$set': analysis}))
+            
+            if updates:
+                collection.bulk_write(updates, ordered=False)
+                self.invalidate_conversation_features(conversation_id)
+            analyzed_count = len(updates)
             
             logger.info(f"Analyzed {analyzed_count} messages for conversation {conversation_id}")
             return analyzed_count
@@ -188,19 +324,11 @@ Message: {content}"""
         Get all unique technical concepts from a conversation
         """
         try:
-            messages = Message.objects(
+            # distinct() unwinds the concept arrays and dedupes them server-side
+            return Message.objects(
                 conversation_id=conversation_id,
                 processed_for_clustering=True
-            )
-            
-            all_concepts = []
-            for message in messages:
-                if message.technical_concepts:
-                    all_concepts.extend(message.technical_concepts)
-            
-            # Return unique concepts
-            unique_concepts = list(set(all_concepts))
-            return unique_concepts
+            ).distinct('technical_concepts')
             
         except Exception as e:
             logger.error(f"Error getting conversation concepts {conversation_id}: {str(e)}")
@@ -211,31 +339,87 @@ Message: {content}"""
         Get average embedding for all messages in a conversation
         """
         try:
-            messages = Message.objects(
-                conversation_id=conversation_id,
-                processed_for_clustering=True
-            )
+            # Only the embeddings are needed for the average
+            vectors = [
+                unpack_embedding(message.embedding)
+                for message in Message.objects(
+                    conversation_id=conversation_id,
+                    processed_for_clustering=True
+                ).only('embedding')
+            ]
+            vectors = [vector for vector in vectors if vector is not None]
             
-            if not messages:
+            if not vectors:
                 return None
             
-            # Calculate average embedding
-            embeddings = []
-            for message in messages:
-                if message.embedding and len(message.embedding) == 1024:
-                    embeddings.append(message.embedding)
-            
-            if not embeddings:
-                return None
-            
-            # Calculate element-wise average
-            avg_embedding = []
-            for i in range(1024):
-                avg_val = sum(emb[i] for emb in embeddings) / len(embeddings)
-                avg_embedding.append(avg_val)
-            
-            return avg_embedding
+            # Element-wise average in one vectorized pass
+            return np.stack(vectors).mean(axis=0, dtype=np.float64).tolist()
             
         except Exception as e:
             logger.error(f"Error getting conversation embedding {conversation_id}: {str(e)}")
             return None
+    
+    def get_conversation_features(self, conversation_id: str, updated_at: datetime) -> Tuple[Optional[List[float]], List[str]]:
+        """
+        Get (average embedding, unique concepts) for a conversation, reusing the last result
+        while the conversation's updated_at is unchanged and none of its messages were analyzed since
+        """
+        return self.get_conversations_features([(conversation_id, updated_at)])[conversation_id]
+    
+    def get_conversations_features(
+        self,
+        conversations: List[Tuple[str, datetime]]
+    ) -> Dict[str, Tuple[Optional[List[float]], List[str]]]:
+        """
+        Bulk get_conversation_features for (conversation_id, updated_at) pairs
+        
+        Cache misses are filled from one pass over their processed messages instead of
+        two queries per conversation.
+        """
+        results = {}
+        misses = {}
+        with self._features_lock:
+            for conversation_id, updated_at in conversations:
+                cached = self._features_cache.get(conversation_id)
+                if cached and cached[0] == updated_at:
+                    results[conversation_id] = (cached[1], cached[2])
+                else:
+                    misses[conversation_id] = updated_at
+        if not misses:
+            return results
+        
+        # Running embedding sums and first-seen-ordered concepts per conversation (dict keys
+        # dedupe like a set but keep a stable order, so concept-count ties break the same way every run)
+        sums = {}
+        counts = {}
+        concepts = {conversation_id: {} for conversation_id in misses}
+        messages = Message.objects(
+            conversation_id__in=list(misses),
+            processed_for_clustering=True
+        ).only('conversation_id', 'embedding', 'technical_concepts')
+        for message in messages:
+            conversation_id = message.conversation_id
+            if message.technical_concepts:
+                concepts[conversation_id].update(dict.fromkeys(message.technical_concepts))
+            vector = unpack_embedding(message.embedding)
+            if vector is not None:
+                if conversation_id in sums:
+                    sums[conversation_id] += vector
+                    counts[conversation_id] += 1
+                else:
+                    sums[conversation_id] = vector.astype(np.float64)
+                    counts[conversation_id] = 1
+        
+        with self._features_lock:
+            for conversation_id, updated_at in misses.items():
+                embedding = (sums[conversation_id] / counts[conversation_id]).tolist() if conversation_id in sums else None
+                features = (embedding, list(concepts[conversation_id]))
+                self._features_cache[conversation_id] = (updated_at,) + features
+                results[conversation_id] = features
+        return results
+    
+    @classmethod
+    def invalidate_conversation_features(cls, conversation_id: str):
+        """Drop the cached features of a conversation"""
+        with cls._features_lock:
+            cls._features_cache.pop(conversation_id, None)
@@ -1,10 +1,11 @@
+import heapq
 from models.cluster import ConversationCluster
 from models.course import Course, CourseConcept
 from services.anthropic_service import AnthropicService
 from services.concept_content_service import ConceptContentService
 from bson import ObjectId
 from bson.errors import InvalidId
-from mongoengine.errors import NotUniqueError
+from pymongo import ReturnDocument
 
 class StudyGuideService:
     """Service for managing unified study guides (courses + available clusters)"""
@@ -29,18 +30,23 @@ class StudyGuideService:
     def get_study_guides():
         """Get unified list of study guides (courses + available clusters)"""
         try:
-            # Get all courses
-            courses = Course.objects.all()
+            # Get all courses, newest first (served by the created_at index)
+            courses = list(Course.objects.order_by('-created_at'))
             course_study_guides = [course.to_study_guide_dict() for course in courses]
             
-            # Get clusters that don't have associated courses
+            # Get clusters that don't have associated courses; the centroid vector isn't part of a study guide
             course_cluster_ids = [course.source_cluster_id for course in courses]
-            available_clusters = ConversationCluster.objects(cluster_id__nin=course_cluster_ids)
+            available_clusters = ConversationCluster.objects(cluster_id__nin=course_cluster_ids) \
+                .exclude('centroid').order_by('-created_at')
             cluster_study_guides = [cluster.to_study_guide_dict() for cluster in available_clusters]
             
-            # Combine and sort by creation date (newest first)
-            all_study_guides = course_study_guides + cluster_study_guides
-            all_study_guides.sort(key=lambda x: x.get('created_at') or '', reverse=True)
+            # Both lists are already newest first, so merge them instead of re-sorting
+            all_study_guides = list(heapq.merge(
+                course_study_guides,
+                cluster_study_guides,
+                key=lambda x: x.get('created_at') or '',
+                reverse=True
+            ))
             
             return all_study_guides
             
@@ -60,27 +66,48 @@ class StudyGuideService:
                 return course
             
             elif item_type == 'cluster':
-                # Create new course from cluster
-                cluster = ConversationCluster.objects(cluster_id=item_id).first()
-                if not cluster:
+                # Load the cluster together with any course already made from it (by
+                # source_cluster_id, or by name to prevent duplicates) in one round-trip
+                results = list(ConversationCluster.objects.aggregate([
+                    {'$match': {'cluster_id': item_id}},
+                    {'$limit': 1},
+                    {'$project': {'centroid': 0}},
+                    {'$lookup': {
+                        'from': Course._get_collection_name(),
+                        'localField': 'cluster_id',
+                        'foreignField': 'source_cluster_id',
+                        'as': 'course_by_source'
+                    }},
+                    {'$lookup': {
+                        'from': Course._get_collection_name(),
+                        'localField': 'label',
+                        'foreignField': 'label',
+                        'as': 'course_by_name'
+                    }}
+                ]))
+                if not results:
                     raise ValueError("Cluster not found")
                 
+                cluster_doc = results[0]
+                course_by_source = cluster_doc.pop('course_by_source')
+                course_by_name = cluster_doc.pop('course_by_name')
+                
                 # Check if course already exists by source_cluster_id
-                existing_course = Course.objects(source_cluster_id=item_id).first()
-                if existing_course:
-                    return existing_course
+                if course_by_source:
+                    return Course._from_son(course_by_source[0])
                 
                 # Check if course already exists by name (label) to prevent duplicates
-                existing_course_by_name = Course.objects(label=cluster.label).first()
-                if existing_course_by_name:
-                    print(f"Found existing course with same name: {cluster.label}, returning existing course")
-                    return existing_course_by_name
+                if course_by_name:
+                    print(f"Found existing course with same name: {cluster_doc['label']}, returning existing course")
+                    return Course._from_son(course_by_name[0])
+                
+                cluster = ConversationCluster._from_son(cluster_doc)
                 
                 anthropic_service = AnthropicService()
                 
-                # Step 1: Refine original topics from raw cluster concepts
+                # Refine original topics and generate related ones in a single call
                 try:
-                    refined_original_data = anthropic_service.refine_original_topics(
+                    topics = anthropic_service.refine_and_expand_topics(
                         raw_concepts=cluster.key_concepts,
                         course_title=cluster.label,
                         course_description=cluster.description
@@ -93,10 +120,18 @@ class StudyGuideService:
                             difficulty_level=concept_data['difficulty_level'],
                             status='not_started',
                             type='original'
-                        ) for concept_data in refined_original_data
+                        ) for concept_data in topics['refined']
+                    ]
+                    related_concepts = [
+                        CourseConcept(
+                            title=concept_data['title'],
+                            difficulty_level=concept_data['difficulty_level'],
+                            status='not_started',
+                            type='related'
+                        ) for concept_data in topics['related']
                     ]
                     
-                    print(f"Refined {len(cluster.key_concepts)} raw concepts into {len(original_concepts)} original topics for course: {cluster.label}")
+                    print(f"Refined {len(cluster.key_concepts)} raw concepts into {len(original_concepts)} original and {len(related_concepts)} related topics for course: {cluster.label}")
                     
                 except Exception as e:
                     print(f"Error refining original topics: {e}")
@@ -109,33 +144,35 @@ class StudyGuideService:
                             type='original'
                         ) for concept in cluster.key_concepts
                     ]
+                    related_concepts = []
                 
-                # Deduplicate original concepts (in case refinement has duplicates)
-                original_concepts = StudyGuideService._deduplicate_concepts_by_title(original_concepts)
+                # Deduplicate concepts (in case refinement has duplicates or related repeats an original)
+                all_concepts = StudyGuideService._deduplicate_concepts_by_title(original_concepts + related_concepts)
                 
-                # Create new course with only original concepts
-                # Related topics will be generated asynchronously by the frontend
+                # Create new course with original and related concepts
+                # (the frontend only fetches related topics itself when none came back)
                 course = Course(
                     label=cluster.label,
                     description=cluster.description,
                     conversation_ids=cluster.conversation_ids,
                     source_cluster_id=item_id,
-                    concepts=original_concepts
+                    concepts=all_concepts
                 )
                 
-                try:
-                    course.save()
-                    return course
-                except NotUniqueError:
-                    # Another request created a course with the same source_cluster_id
-                    # Return the existing course instead
-                    existing_course = Course.objects(source_cluster_id=item_id).first()
-                    if existing_course:
-                        print(f"Course already exists for cluster {item_id}, returning existing course")
-                        return existing_course
-                    else:
-                        # This shouldn't happen, but handle it gracefully
-                        raise ValueError("Failed to create course due to duplicate constraint, but existing course not found")
+                # Insert only if no course exists for this cluster yet; a concurrent request
+                # that got there first wins atomically and its course is returned instead
+                course.validate()
+                course_son = course.to_mongo().to_dict()
+                course_son['_id'] = ObjectId()
+                course_doc = Course._get_collection().find_one_and_update(
+                    {'source_cluster_id': item_id},
+                    {'$setOnInsert': course_son},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                if course_doc['_id'] != course_son['_id']:
+                    print(f"Course already exists for cluster {item_id}, returning existing course")
+                return Course._from_son(course_doc)
             
             else:
                 raise ValueError("Invalid item type. Must be 'course' or 'cluster'")
@@ -260,8 +297,9 @@ class StudyGuideService:
             
             # Validate that selected concepts exist and are not_started
             valid_concepts = []
+            concept_map = course.get_concept_map()
             for title in selected_concept_titles:
-                concept = course.get_concept_by_title(title)
+                concept = concept_map.get(title)
                 if not concept:
                     raise ValueError(f"Concept '{title}' not found in course")
                 valid_concepts.append(concept)
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import ConceptSelector from './ConceptSelector'
 import AbsorbStage from './AbsorbStage'
 import TeachBackStage from './TeachBackStage'
@@ -37,6 +37,8 @@ function CourseView({ courseId, clusterId, onBack }: CourseViewProps) {
   const [originalTopicsError, setOriginalTopicsError] = useState<string | null>(null);
   const [creatingCourse, setCreatingCourse] = useState(false);
   const [actualCourseId, setActualCourseId] = useState<string>(courseId);
+  // Course id whose related topics already arrived with course creation
+  const relatedTopicsPreloadedFor = useRef<string | null>(null);
 
   useEffect(() => {
     fetchCourseOrCreateFromCluster();
@@ -55,7 +57,7 @@ function CourseView({ courseId, clusterId, onBack }: CourseViewProps) {
 
   // Fetch related topics asynchronously after course loads
   useEffect(() => {
-    if (course && !loadingRelatedTopics) {
+    if (course && !loadingRelatedTopics && relatedTopicsPreloadedFor.current !== course.id) {
       fetchRelatedTopics();
     }
   }, [course?.id]); // Only trigger when course ID changes
@@ -92,6 +94,9 @@ function CourseView({ courseId, clusterId, onBack }: CourseViewProps) {
 
         if (createResponse.ok) {
           const createData = await createResponse.json();
+          if (createData.course.concepts.some((concept: CourseConcept) => concept.type === 'related')) {
+            relatedTopicsPreloadedFor.current = createData.course.id;
+          }
           setCourse(createData.course);
           setActualCourseId(createData.course.id); // Save the actual course ID
           setLoadingOriginalTopics(false);
@@ -129,6 +134,9 @@ function CourseView({ courseId, clusterId, onBack }: CourseViewProps) {
 
         if (createResponse.ok) {
           const createData = await createResponse.json();
+          if (createData.course.concepts.some((concept: CourseConcept) => concept.type === 'related')) {
+            relatedTopicsPreloadedFor.current = createData.course.id;
+          }
           setCourse(createData.course);
           setActualCourseId(createData.course.id); // Save the actual course ID
           setLoadingOriginalTopics(false);